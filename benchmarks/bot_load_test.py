@@ -0,0 +1,381 @@
+"""
+Load test for the event handlers in `student_verification_bot.py`, without connecting to Discord.
+
+Usage: `python benchmarks/bot_load_test.py --students 5000 --duration 60 --output results.json`
+
+Simulated students react to the gate message and then DM their email, arriving uniformly over `--duration`
+seconds with at most `--concurrency` handlers running at once. Discord is replaced with local fakes: users,
+DM channels and members whose `send`/`add_roles` take `--send-latency` seconds and fail with a 429 (with a
+`Retry-After` header) `--rate-limit-prob` of the time. The database is a temporary SQLite file, and
+`--verifier-writes` per second are made from a separate sqlite3 connection, as `verify_students.py --watch`
+would, to measure how long each side waits on the other's write lock.
+
+To include the memory discord.py's own caches would take on a real server, `--guild-members` and
+`--guild-messages` feed a synthetic guild and channel messages through the bot's gateway state, the way the
+chosen `--gateway-profile` would receive them (with `low_memory`, neither is sent by Discord). Members are only
+sent with `--restore-on-join`, which turns on the members intent.
+
+The results are printed (or written to `--output`) as JSON: throughput, p50/p99 latency for each handler,
+lock waits, peak memory, and the bot's own metrics (see `metrics.py`). Keep the JSON from before and after a
+change to compare them.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import resource
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+
+import discord
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def latency_summary(values):
+    return {
+        'count': len(values),
+        'p50': percentile(values, 0.5),
+        'p99': percentile(values, 0.99),
+        'max': max(values, default=0.0),
+    }
+
+class FakeDiscord:
+    """Stand-ins for the users, DM channels, guild and members the handlers talk to"""
+    def __init__(self, send_latency, rate_limit_prob, retry_after):
+        self.send_latency = send_latency
+        self.rate_limit_prob = rate_limit_prob
+        self.retry_after = retry_after
+        self.users = {}
+        self.sent = 0
+        self.rate_limited = 0
+        self.roles_assigned = 0
+        self.role = types.SimpleNamespace(name='verified')
+        self.guild = types.SimpleNamespace(
+            id=1, roles=[self.role], get_member=lambda user_id: None, fetch_member=self.fetch_member
+        )
+        self.channel = types.SimpleNamespace(guild=self.guild)
+
+    async def request(self):
+        await asyncio.sleep(self.send_latency)
+        if random.random() < self.rate_limit_prob:
+            self.rate_limited += 1
+            response = types.SimpleNamespace(
+                status=429, reason='Too Many Requests', headers={'Retry-After': str(self.retry_after)}
+            )
+            raise discord.HTTPException(response, 'You are being rate limited.')
+
+    def user(self, user_id):
+        user = self.users.get(user_id)
+        if user is None:
+            user = self.users[user_id] = FakeUser(self, user_id)
+        return user
+
+    async def fetch_user(self, user_id):
+        await asyncio.sleep(self.send_latency)
+        return self.user(user_id)
+
+    async def fetch_member(self, user_id):
+        await asyncio.sleep(self.send_latency)
+        return FakeMember(self, user_id)
+
+class FakeUser:
+    def __init__(self, fake, user_id):
+        self.fake = fake
+        self.id = user_id
+        self.name = f"student{user_id}"
+        self.bot = False
+
+    def __str__(self):
+        return self.name
+
+    async def send(self, content):
+        await self.fake.request()
+        self.fake.sent += 1
+
+class FakeDMChannel(discord.DMChannel):
+    # `on_message` only handles DMs, so this has to pass the `isinstance` check
+    def __init__(self, fake):
+        self.fake = fake
+
+    async def send(self, content):
+        await self.fake.request()
+        self.fake.sent += 1
+
+class FakeMember:
+    def __init__(self, fake, user_id):
+        self.fake = fake
+        self.id = user_id
+        self.roles = []
+
+    async def add_roles(self, role, reason=None):
+        await self.fake.request()
+        self.roles.append(role)
+        self.fake.roles_assigned += 1
+
+class VerifierWriter(threading.Thread):
+    """Writes to the database from another connection, like `verify_students.py`, timing its lock waits"""
+    def __init__(self, database_path, writes_per_second):
+        super().__init__(daemon=True)
+        self.database_path = database_path
+        self.interval = 1 / writes_per_second
+        self.stopped = threading.Event()
+        self.lock_waits = []
+        self.errors = 0
+
+    def run(self):
+        conn = sqlite3.connect(self.database_path, timeout=5, isolation_level=None)
+        while not self.stopped.wait(self.interval):
+            start = time.perf_counter()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                self.lock_waits.append(time.perf_counter() - start)
+                conn.execute(
+                    "UPDATE student_emails SET verified = TRUE WHERE rowid IN "
+                    "(SELECT rowid FROM student_emails WHERE verified = FALSE LIMIT 10)"
+                )
+                conn.execute("COMMIT")
+            except sqlite3.OperationalError:
+                self.errors += 1
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+        conn.close()
+
+def user_data(user_id):
+    return {'id': str(user_id), 'username': f"member{user_id}", 'discriminator': '0', 'avatar': None}
+
+def populate_gateway_caches(bot, profile, members, messages):
+    """Feeds a guild with `members` members and `messages` channel messages through the gateway parser"""
+    state = bot._connection
+    guild_id, channel_id = 10, 11
+    role = {
+        'id': str(guild_id), 'name': '@everyone', 'permissions': '0', 'position': 0, 'color': 0,
+        'hoist': False, 'managed': False, 'mentionable': False,
+    }
+    data = {
+        'id': str(guild_id),
+        'name': 'Course',
+        'roles': [role, dict(role, id='12', name='verified', position=1)],
+        'channels': [{'id': str(channel_id), 'type': 0, 'name': 'general', 'position': 0, 'permission_overwrites': []}],
+        'member_count': members,
+        # Without the members intent Discord only sends the bot's own member
+        'members': [] if not bot.intents.members else [
+            {
+                'user': user_data(10 ** 6 + i), 'roles': [], 'joined_at': '2025-01-01T00:00:00+00:00',
+                'deaf': False, 'mute': False, 'flags': 0,
+            }
+            for i in range(members)
+        ],
+    }
+    state._add_guild_from_data(data)
+    if profile == 'low_memory':
+        # Guild messages need the guild_messages intent
+        return
+    for i in range(messages):
+        state.parse_message_create({
+            'id': str(10 ** 7 + i),
+            'channel_id': str(channel_id),
+            'guild_id': str(guild_id),
+            'author': user_data(10 ** 6 + i % max(members, 1)),
+            'content': f"Question {i} about the homework, does anyone know how to get started?",
+            'timestamp': '2025-01-01T00:00:00+00:00',
+            'edited_timestamp': None,
+            'tts': False,
+            'mention_everyone': False,
+            'mentions': [],
+            'mention_roles': [],
+            'attachments': [],
+            'embeds': [],
+            'pinned': False,
+            'type': 0,
+        })
+
+async def simulate_student(bot_module, fake, semaphore, user_id, email, reply_delay, latencies):
+    payload = types.SimpleNamespace(
+        message_id=bot_module.gates[0].message_id,
+        emoji=types.SimpleNamespace(name=bot_module.gates[0].emoji),
+        user_id=user_id,
+        member=None,
+        guild_id=None,
+    )
+    async with semaphore:
+        start = time.perf_counter()
+        await bot_module.on_raw_reaction_add(payload)
+        latencies['on_raw_reaction_add'].append(time.perf_counter() - start)
+    await asyncio.sleep(reply_delay)
+    message = types.SimpleNamespace(
+        author=fake.user(user_id), content=email, channel=FakeDMChannel(fake), guild=None
+    )
+    async with semaphore:
+        start = time.perf_counter()
+        await bot_module.on_message(message)
+        latencies['on_message'].append(time.perf_counter() - start)
+
+async def run(args, database_path):
+    # The bot reads its configuration when imported
+    os.environ.update({
+        'DISCORD_TOKEN': 'load-test',
+        'DATABASE_PATH': database_path,
+        'CHANNEL_ID': '1',
+        'MESSAGE_ID': '2',
+        'GATES_PATH': '',
+        'METRICS_PORT': '0',
+        'ROSTER_SNAPSHOT_PATH': '',
+        'DM_GLOBAL_RATE': str(args.dm_global_rate),
+        'GATEWAY_PROFILE': args.gateway_profile,
+        'RESTORE_ON_JOIN': '1' if args.restore_on_join else '',
+    })
+    sys.path.insert(0, REPO_ROOT)
+    import metrics
+    import student_verification_bot as bot_module
+
+    fake = FakeDiscord(args.send_latency, args.rate_limit_prob, args.retry_after)
+    bot = bot_module.bot
+    bot._connection.user = types.SimpleNamespace(id=0)
+    bot.get_user = lambda user_id: None
+    bot.fetch_user = fake.fetch_user
+    bot.get_channel = lambda channel_id: fake.channel
+
+    async def process_commands(message):
+        pass
+
+    never_ready = asyncio.Event()
+
+    async def wait_until_ready():
+        # Keeps the background loops (sweeps, roster refresh) from running against the fakes
+        await never_ready.wait()
+
+    bot.process_commands = process_commands
+    bot.wait_until_ready = wait_until_ready
+    # What `login` would do first, so events from the gateway parser can be dispatched
+    await bot._async_setup_hook()
+    await bot.setup_hook()
+    writer = None
+    try:
+        populate_gateway_caches(bot, args.gateway_profile, args.guild_members, args.guild_messages)
+
+        emails = [f"student{user_id}@example.com" for user_id in range(1, args.students + 1)]
+        authorized = random.sample(emails, int(len(emails) * args.authorized_fraction))
+        bot_module.rosters[bot_module.gates[0].course].emails = set(authorized)
+
+        if args.verifier_writes > 0:
+            writer = VerifierWriter(database_path, args.verifier_writes)
+            writer.start()
+
+        latencies = {'on_raw_reaction_add': [], 'on_message': []}
+        semaphore = asyncio.Semaphore(args.concurrency)
+        interval = args.duration / args.students
+        if args.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        tasks = []
+        for user_id, email in enumerate(emails, 1):
+            tasks.append(asyncio.create_task(
+                simulate_student(bot_module, fake, semaphore, user_id, email, args.reply_delay, latencies)
+            ))
+            await asyncio.sleep(interval)
+        await asyncio.gather(*tasks)
+        handlers_done = time.perf_counter() - start
+        try:
+            await asyncio.wait_for(bot_module.dm_queue.queue.join(), args.drain_timeout)
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.perf_counter() - start
+        peak_traced = None
+        if args.trace_memory:
+            _, peak_traced = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        dm_stats = bot_module.dm_queue.stats()
+    finally:
+        # Otherwise the aiosqlite thread keeps the process alive if anything above fails
+        if writer is not None:
+            writer.stopped.set()
+            writer.join()
+        bot_module.sweep_pending_verifications.cancel()
+        bot_module.refresh_roster.cancel()
+        await bot_module.dm_queue.stop(timeout=0)
+        await bot_module.submission_writer.stop()
+        await bot_module.close_db()
+
+    handled = sum(len(values) for values in latencies.values())
+    bot_sqlite = metrics.registry.metrics['sqlite_query_seconds'].summary()
+    return {
+        'config': vars(args),
+        'handler_seconds': round(handlers_done, 3),
+        'elapsed_seconds': round(elapsed, 3),
+        'throughput_events_per_second': round(handled / handlers_done, 1),
+        'latency_seconds': {name: latency_summary(values) for name, values in latencies.items()},
+        'lock_waits': {
+            # How long the bot's queries took while sharing the file with the verifier
+            'bot_sqlite_query_p99_max': max((series['p99'] for series in bot_sqlite.values()), default=0.0),
+            'verifier_begin_immediate': latency_summary(writer.lock_waits) if writer else None,
+            'verifier_locked_errors': writer.errors if writer else 0,
+        },
+        'memory': {
+            # Python allocations only, with --trace-memory (which slows the handlers down)
+            'peak_traced_bytes': peak_traced,
+            # Kilobytes on Linux
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        },
+        'gateway_cache': {
+            'members': sum(len(guild.members) for guild in bot.guilds),
+            'messages': len(bot.cached_messages),
+        },
+        'discord': {
+            'sent': fake.sent,
+            'rate_limited': fake.rate_limited,
+            'roles_assigned': fake.roles_assigned,
+        },
+        'dm_queue': dm_stats,
+        'metrics': metrics.registry.summary(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=5000)
+    parser.add_argument('--duration', type=float, default=60, help="Seconds over which students arrive")
+    parser.add_argument('--concurrency', type=int, default=200, help="Handlers running at once")
+    parser.add_argument('--reply-delay', type=float, default=1.0, help="Seconds between reacting and replying")
+    parser.add_argument('--authorized-fraction', type=float, default=0.9, help="Share of students on the roster")
+    parser.add_argument('--send-latency', type=float, default=0.05, help="Seconds each fake Discord request takes")
+    parser.add_argument('--rate-limit-prob', type=float, default=0.01, help="Share of requests that get a 429")
+    parser.add_argument('--retry-after', type=float, default=0.5, help="Retry-After of the simulated 429s")
+    parser.add_argument('--dm-global-rate', type=float, default=40, help="Same as DM_GLOBAL_RATE for the bot")
+    parser.add_argument('--verifier-writes', type=float, default=1, help="Writes per second from another connection")
+    parser.add_argument('--drain-timeout', type=float, default=300, help="Seconds to wait for queued DMs")
+    parser.add_argument('--gateway-profile', choices=['default', 'low_memory'], default='default')
+    parser.add_argument('--restore-on-join', action='store_true', help="Same as RESTORE_ON_JOIN=1 for the bot")
+    parser.add_argument('--guild-members', type=int, default=0, help="Members in the synthetic guild")
+    parser.add_argument('--guild-messages', type=int, default=0, help="Guild messages received before the test")
+    parser.add_argument('--trace-memory', action='store_true', help="Also report peak Python allocations")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write the JSON results here instead of printing them")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    # Keep the bot's own logging out of the JSON
+    with tempfile.TemporaryDirectory() as tmp_dir, contextlib.redirect_stdout(sys.stderr):
+        results = asyncio.run(run(args, os.path.join(tmp_dir, 'load_test.db')))
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+Scalability benchmark for the modes of `verify_students.py`, on synthetic cohorts and without Discord.
+
+Usage: `python benchmarks/verifier_benchmark.py --sizes 1000 10000 100000 --output results.json`
+
+For each size this generates a `student_emails` database and a Maven-format CSV roster. By default the CSV
+has the mojibake spelling of the "Users → Email" header that Maven's export decodes to. The roster is served
+from a local HTTP server, so the real streaming download in `roster.py` is exercised. Each phase then runs
+end to end in its own process, on its own copy of the database:
+- `display_pending_students` (the default interactive mode, up to the prompt)
+- `auto_verify_from_csv` (`--auto`)
+- `re_verify_all` (`--reverify`)
+- `show_all_students` (`--all`)
+- `reconcile_roles` (`--reconcile --apply`)
+The guild is a fake with a verified role held by `--role-holders` of the verified students, and the phase's
+output goes to /dev/null.
+
+Each result has the wall time, the number of SQL statements the phase ran (from `set_trace_callback`) and
+the peak RSS of its process, printed as JSON (or written to `--output`).
+"""
+
+import argparse
+import asyncio
+import contextlib
+import functools
+import http.server
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import types
+from datetime import datetime, timedelta
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from schema import migrate
+
+PHASES = ('display_pending_students', 'auto_verify_from_csv', 're_verify_all', 'show_all_students', 'reconcile_roles')
+# The synthetic roster revokes far more students than `RECONCILE_MAX_REMOVALS` allows
+PHASE_KWARGS = {'reconcile_roles': {'apply': True, 'max_removals': sys.maxsize}}
+HEADERS = {
+    'mojibake': 'Users â\u0086\u0092 Email',
+    'utf8': 'Users → Email',
+}
+
+def generate_cohort(directory, size, header, verified_fraction, roster_fraction):
+    """Writes `students.db` and `roster.csv` for `size` students to `directory`"""
+    database_path = os.path.join(directory, 'students.db')
+    conn = sqlite3.connect(database_path)
+    with contextlib.redirect_stdout(sys.stderr):
+        migrate(conn)
+    start = datetime(2025, 1, 1)
+    rows = []
+    for user_id in range(1, size + 1):
+        email = f"Student{user_id}@Example.com"
+        submitted = start + timedelta(seconds=user_id * 30)
+        rows.append((
+            100000000000000000 + user_id,
+            f"student{user_id}",
+            # Like real submissions, not always in the same case or without stray whitespace
+            email if user_id % 7 else f" {email} ",
+            email.strip().lower(),
+            submitted.isoformat(),
+            int(submitted.timestamp()),
+            random.random() < verified_fraction,
+        ))
+    conn.executemany(
+        "INSERT INTO student_emails (user_id, username, email, email_normalized, submitted_at, submitted_ts, verified) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        rows
+    )
+    conn.commit()
+    conn.close()
+
+    # Every student on the roster plus as many people who never joined the Discord
+    roster_path = os.path.join(directory, 'roster.csv')
+    with open(roster_path, 'w', encoding='utf-8', newline='') as f:
+        f.write(f'Users → Name,{HEADERS[header]},Enrolled At\r\n')
+        for user_id in range(1, int(size * 2 * roster_fraction) + 1):
+            f.write(f'Student {user_id},student{user_id}@example.com,2025-01-01\r\n')
+    return database_path, roster_path
+
+class CSVHandler(http.server.SimpleHTTPRequestHandler):
+    def guess_type(self, path):
+        # Maven doesn't send a charset either
+        return 'text/csv'
+
+    def log_message(self, *args):
+        pass
+
+def serve_directory(directory):
+    handler = functools.partial(CSVHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+class FakeMember:
+    def __init__(self, user_id, roles):
+        self.id = user_id
+        self.roles = roles
+
+    async def add_roles(self, role, reason=None):
+        self.roles.append(role)
+
+    async def remove_roles(self, role, reason=None):
+        self.roles.remove(role)
+
+class FakeGuild:
+    def __init__(self, members):
+        self.id = 1
+        self.members = members
+
+    def get_member(self, user_id):
+        return self.members.get(user_id)
+
+def fake_guild_roles(database_path, role_holders_fraction):
+    """Every student is in the guild, and `role_holders_fraction` of the verified ones have the role"""
+    role = types.SimpleNamespace(id=1, name='verified', members=[])
+    members = {}
+    conn = sqlite3.connect(database_path)
+    for user_id, verified in conn.execute("SELECT user_id, verified FROM student_emails"):
+        has_role = verified and random.random() < role_holders_fraction
+        member = members[user_id] = FakeMember(user_id, [role] if has_role else [])
+        if has_role:
+            role.members.append(member)
+    conn.close()
+    return [(FakeGuild(members), role)]
+
+def run_phase(phase, database_path, maven_url, snapshot_path, role_holders_fraction, seed, results):
+    """Runs in a fresh process so the RSS peak is the phase's own"""
+    random.seed(seed)
+    os.environ.update({
+        'DATABASE_PATH': database_path,
+        'DISCORD_TOKEN': 'benchmark',
+        'MAVEN_URL': maven_url,
+        'ROSTER_SNAPSHOT_PATH': snapshot_path,
+        'GATES_PATH': '',
+    })
+    sys.argv = ['verify_students.py']
+    import verify_students
+
+    guild_roles = fake_guild_roles(database_path, role_holders_fraction)
+    verify_students.discord_ready = lambda: True
+    verify_students.resolve_verified_roles = lambda: guild_roles
+
+    statements = 0
+    connect_db = verify_students.connect_db
+
+    def counting_connect_db():
+        def count(statement):
+            nonlocal statements
+            statements += 1
+        conn = connect_db()
+        conn.set_trace_callback(count)
+        return conn
+
+    verify_students.connect_db = counting_connect_db
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        result = getattr(verify_students, phase)(**PHASE_KWARGS.get(phase, {}))
+        if asyncio.iscoroutine(result):
+            asyncio.run(result)
+        elif result:
+            # `display_pending_students` hands its connection to the interactive prompt
+            result[0].close()
+    results.put({
+        'phase': phase,
+        'wall_seconds': round(time.perf_counter() - start, 4),
+        'sql_statements': statements,
+        # Kilobytes on Linux
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'rss_before_phase_kb': rss_before,
+    })
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--phases', nargs='+', choices=PHASES, default=list(PHASES))
+    parser.add_argument('--header', choices=sorted(HEADERS), default='mojibake', help="Email column header")
+    parser.add_argument('--verified-fraction', type=float, default=0.5, help="Share already verified")
+    parser.add_argument('--roster-fraction', type=float, default=0.45, help="Roster size, as a share of 2 x size")
+    parser.add_argument('--role-holders', type=float, default=0.8, help="Share of verified students with the role")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write the JSON results here instead of printing them")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    context = multiprocessing.get_context('spawn')
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        server = serve_directory(tmp_dir)
+        try:
+            for size in args.sizes:
+                cohort_dir = os.path.join(tmp_dir, str(size))
+                os.mkdir(cohort_dir)
+                start = time.perf_counter()
+                database_path, roster_path = generate_cohort(
+                    cohort_dir, size, args.header, args.verified_fraction, args.roster_fraction
+                )
+                print(f"Generated {size} students in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+                maven_url = f"http://127.0.0.1:{server.server_port}/{size}/roster.csv"
+                for phase in args.phases:
+                    phase_dir = os.path.join(cohort_dir, phase)
+                    os.mkdir(phase_dir)
+                    phase_database = os.path.join(phase_dir, 'students.db')
+                    shutil.copy(database_path, phase_database)
+                    queue = context.Queue()
+                    process = context.Process(target=run_phase, args=(
+                        phase, phase_database, maven_url, os.path.join(phase_dir, 'maven_roster.json'),
+                        args.role_holders, args.seed, queue,
+                    ))
+                    process.start()
+                    process.join()
+                    if process.exitcode != 0:
+                        raise SystemExit(f"{phase} failed for {size} students")
+                    result = queue.get()
+                    result['students'] = size
+                    results.append(result)
+                    print(
+                        f"{size:>7} {phase:<26} {result['wall_seconds']:>8.3f}s "
+                        f"{result['sql_statements']:>8} statements {result['peak_rss_kb'] / 1024:>7.1f} MB",
+                        file=sys.stderr
+                    )
+        finally:
+            server.shutdown()
+
+    output = json.dumps({'config': vars(args), 'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
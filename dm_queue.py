@@ -0,0 +1,187 @@
+"""
+Outbound message scheduler used by `student_verification_bot.py`.
+
+Event handlers call `DMQueue.send(...)` which only enqueues the message, so a slow or rate limited
+DM never holds up the reaction/message handlers. A small pool of worker tasks drains the queue in
+priority order (replies to submitted emails go out before welcome DMs, which go out before reminders, and
+welcomes for reactions caught up on at startup go out last).
+
+discord.py already tracks the per-route `X-RateLimit-*` headers of successful requests internally,
+so the scheduler only paces itself so we don't hit them in the first place:
+- a global token bucket (Discord allows ~50 requests/second per bot)
+- a token bucket per destination, matching Discord's per-channel `POST /channels/{id}/messages` bucket
+When a 429 does come back, the `Retry-After` header of the response pauses the relevant bucket (and the
+global one if `X-RateLimit-Global` is set) before the message is retried.
+"""
+
+import asyncio
+import itertools
+import time
+
+import discord
+
+PRIORITY_REPLY = 0
+PRIORITY_WELCOME = 1
+PRIORITY_REMINDER = 2
+PRIORITY_BACKFILL = 3
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def is_idle(self):
+        now = time.monotonic()
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.paused_until
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+def retry_after_from(error):
+    """Reads how long to back off from a 429 `discord.HTTPException` using the response's rate limit headers"""
+    headers = getattr(error.response, 'headers', None) or {}
+    for header in ('Retry-After', 'X-RateLimit-Reset-After'):
+        if header in headers:
+            return float(headers[header])
+    return 1.0
+
+class DMQueue:
+    def __init__(self, workers=4, maxsize=10000, global_rate=40, per_destination_rate=1, per_destination_burst=5, max_attempts=3):
+        self.num_workers = workers
+        self.queue = asyncio.PriorityQueue(maxsize=maxsize)
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.per_destination_rate = per_destination_rate
+        self.per_destination_burst = per_destination_burst
+        self.destination_buckets = {}
+        self.max_attempts = max_attempts
+        self.workers = []
+        self._sequence = itertools.count()
+        # Backpressure metrics
+        self.enqueued = 0
+        self.sent = 0
+        self.failed = 0
+        self.rate_limited = 0
+        self.retry_after_total = 0.0
+        self.blocked_enqueues = 0
+        self.max_depth = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def start(self):
+        if not self.workers:
+            self.workers = [asyncio.create_task(self._worker()) for _ in range(self.num_workers)]
+
+    async def stop(self, timeout=5):
+        """Gives queued messages up to `timeout` seconds to go out, then cancels the workers"""
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"Dropping {self.queue.qsize()} queued DMs on shutdown")
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    async def send(self, destination, content, priority=PRIORITY_WELCOME, on_forbidden=None, on_sent=None):
+        """
+        Queues `content` to be sent to `destination` (a user, member or channel). `on_forbidden` is an optional
+        coroutine function called if the user has DMs disabled, `on_sent` an optional function called once
+        the message has gone out.
+        """
+        item = (priority, next(self._sequence), time.monotonic(), destination, content, on_forbidden, on_sent)
+        if self.queue.full():
+            self.blocked_enqueues += 1
+        await self.queue.put(item)
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def _bucket_for(self, destination):
+        key = getattr(destination, 'id', id(destination))
+        bucket = self.destination_buckets.get(key)
+        if bucket is None:
+            if len(self.destination_buckets) > 1000:
+                # Forget destinations that haven't sent anything recently
+                self.destination_buckets = {k: b for k, b in self.destination_buckets.items() if not b.is_idle()}
+            bucket = self.destination_buckets[key] = TokenBucket(self.per_destination_rate, self.per_destination_burst)
+        return bucket
+
+    async def _worker(self):
+        while True:
+            item = await self.queue.get()
+            try:
+                await self._deliver(item)
+            except Exception as e:
+                self.failed += 1
+                print(f"Error sending DM: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _deliver(self, item):
+        _, _, enqueued_at, destination, content, on_forbidden, on_sent = item
+        bucket = self._bucket_for(destination)
+        for _ in range(self.max_attempts):
+            await bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                await destination.send(content)
+            except discord.Forbidden:
+                self.failed += 1
+                if on_forbidden is not None:
+                    await on_forbidden()
+                return
+            except discord.RateLimited as e:
+                retry_after, is_global = e.retry_after, False
+            except discord.HTTPException as e:
+                if e.status != 429:
+                    raise
+                retry_after = retry_after_from(e)
+                is_global = (getattr(e.response, 'headers', None) or {}).get('X-RateLimit-Global') == 'true'
+            else:
+                waited = time.monotonic() - enqueued_at
+                self.sent += 1
+                self.total_wait += waited
+                self.max_wait = max(self.max_wait, waited)
+                if on_sent is not None:
+                    on_sent()
+                return
+            self.rate_limited += 1
+            self.retry_after_total += retry_after
+            bucket.pause(retry_after)
+            if is_global:
+                self.global_bucket.pause(retry_after)
+        self.failed += 1
+        print(f"Giving up on DM to {destination} after {self.max_attempts} rate limited attempts")
+
+    def stats(self):
+        return {
+            'depth': self.queue.qsize(),
+            'max_depth': self.max_depth,
+            'enqueued': self.enqueued,
+            'sent': self.sent,
+            'failed': self.failed,
+            'rate_limited': self.rate_limited,
+            'retry_after_total': self.retry_after_total,
+            'blocked_enqueues': self.blocked_enqueues,
+            'avg_wait': self.total_wait / self.sent if self.sent else 0.0,
+            'max_wait': self.max_wait,
+        }
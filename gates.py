@@ -0,0 +1,73 @@
+"""
+Registry of verification gates, shared by `student_verification_bot.py` and `verify_students.py`.
+
+A gate is a message students react to in order to join a course. Each one has its own roster and role, so
+several Maven cohorts can be run from the same bot at once, and a student can be enrolled in more than one.
+
+Env variables:
+- GATES_PATH: (Optional) A JSON file listing the gates, e.g.
+    [
+        {"course": "scratch-to-scale", "channel_id": 123, "message_id": 456,
+         "emoji": "➕", "role": "verified", "maven_url": "https://..."}
+    ]
+  `emoji` defaults to ➕, `role` to "verified" and `maven_url` to `MAVEN_URL`.
+- CHANNEL_ID, MESSAGE_ID: Used to build a single gate for the "default" course when `GATES_PATH` isn't set
+"""
+
+import json
+import os
+
+from dotenv import load_dotenv
+
+from roster import MAVEN_URL, ROSTER_SNAPSHOT_PATH
+
+load_dotenv()
+
+GATES_PATH = os.getenv('GATES_PATH')
+DEFAULT_COURSE = 'default'
+DEFAULT_EMOJI = '➕'
+DEFAULT_ROLE_NAME = 'verified'
+
+class Gate:
+    __slots__ = ('course', 'channel_id', 'message_id', 'emoji', 'role_name', 'maven_url', 'snapshot_path')
+
+    def __init__(self, course, channel_id, message_id, emoji=DEFAULT_EMOJI, role_name=DEFAULT_ROLE_NAME, maven_url=MAVEN_URL, snapshot_path=None):
+        self.course = course
+        self.channel_id = channel_id
+        self.message_id = message_id
+        self.emoji = emoji
+        self.role_name = role_name
+        self.maven_url = maven_url
+        if snapshot_path is None:
+            # Keep the original snapshot name for the single course setup
+            snapshot_path = ROSTER_SNAPSHOT_PATH if course == DEFAULT_COURSE else f"maven_roster_{course}.json"
+        self.snapshot_path = snapshot_path
+
+    def __repr__(self):
+        return f"Gate({self.course!r}, message_id={self.message_id}, emoji={self.emoji!r})"
+
+def load_gates(gates_path=GATES_PATH):
+    if gates_path:
+        with open(gates_path) as f:
+            entries = json.load(f)
+        gates = [
+            Gate(
+                entry['course'],
+                int(entry['channel_id']),
+                int(entry['message_id']),
+                emoji=entry.get('emoji', DEFAULT_EMOJI),
+                role_name=entry.get('role', DEFAULT_ROLE_NAME),
+                maven_url=entry.get('maven_url', MAVEN_URL),
+                snapshot_path=entry.get('snapshot_path'),
+            )
+            for entry in entries
+        ]
+    else:
+        channel_id, message_id = os.getenv('CHANNEL_ID'), os.getenv('MESSAGE_ID')
+        if not channel_id or not message_id:
+            return []
+        gates = [Gate(DEFAULT_COURSE, int(channel_id), int(message_id))]
+    courses = [gate.course for gate in gates]
+    if len(set(courses)) != len(courses):
+        raise ValueError(f"Duplicate course names in {gates_path}: {courses}")
+    return gates
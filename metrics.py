@@ -0,0 +1,212 @@
+"""
+Counters, gauges and latency histograms for `student_verification_bot.py` and `verify_students.py`.
+
+Everything is kept in a process-wide `registry`. The bot serves it in the Prometheus text format on a local
+HTTP port (`serve`), the verifier writes it out as a JSON summary when it exits (`write_summary`). There are
+no extra dependencies, so this only implements the parts of the Prometheus format we use.
+"""
+
+import asyncio
+import bisect
+import json
+import sys
+import time
+from contextlib import contextmanager
+
+# Seconds, from a cached SQLite read up to a Discord request waiting out a long rate limit
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _summary_key(key):
+    """Labels as a readable dict key for the JSON summary, e.g. `query=lookup_student`"""
+    return ','.join(f'{name}={value}' for name, value in key) or 'all'
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help, callback=None):
+        self.name = name
+        self.help = help
+        # For values that are already tracked elsewhere (e.g. `DMQueue` stats), read when rendering
+        self.callback = callback
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def collect(self):
+        if self.callback is not None:
+            return {(): self.callback()}
+        return self.values
+
+    def render(self):
+        return [f'{self.name}{_format_labels(key)} {value}' for key, value in self.collect().items()]
+
+    def summary(self):
+        return {_summary_key(key): value for key, value in self.collect().items()}
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        self.values[_label_key(labels)] = value
+
+class HistogramSeries:
+    __slots__ = ('counts', 'count', 'sum', 'max')
+
+    def __init__(self, num_buckets):
+        # Per bucket, not cumulative; the last one is +Inf
+        self.counts = [0] * (num_buckets + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.series = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = HistogramSeries(len(self.buckets))
+        series.counts[bisect.bisect_left(self.buckets, value)] += 1
+        series.count += 1
+        series.sum += value
+        series.max = max(series.max, value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes how long the `with` block took, including any awaits inside it"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def quantile(self, series, q):
+        """Estimates a quantile as the upper bound of the bucket it falls in"""
+        target = q * series.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, series.counts):
+            cumulative += count
+            if cumulative >= target:
+                return min(bound, series.max)
+        return series.max
+
+    def render(self):
+        lines = []
+        for key, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series.counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_format_labels(key + (("le", bound),))} {cumulative}')
+            lines.append(f'{self.name}_bucket{_format_labels(key + (("le", "+Inf"),))} {series.count}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {series.sum}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {series.count}')
+        return lines
+
+    def summary(self):
+        return {
+            _summary_key(key): {
+                'count': series.count,
+                'sum': round(series.sum, 6),
+                'avg': round(series.sum / series.count, 6) if series.count else 0.0,
+                'p50': round(self.quantile(series, 0.5), 6),
+                'p99': round(self.quantile(series, 0.99), 6),
+                'max': round(series.max, 6),
+            }
+            for key, series in self.series.items()
+        }
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = cls(name, *args, **kwargs)
+        return metric
+
+    def counter(self, name, help, callback=None):
+        return self._get_or_create(Counter, name, help, callback=callback)
+
+    def gauge(self, name, help, callback=None):
+        return self._get_or_create(Gauge, name, help, callback=callback)
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help, buckets=buckets)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        return {name: metric.summary() for name, metric in self.metrics.items() if metric.summary()}
+
+registry = Registry()
+counter = registry.counter
+gauge = registry.gauge
+histogram = registry.histogram
+
+async def serve(port, host='127.0.0.1'):
+    """Serves `registry` on http://host:port/metrics. Returns the `asyncio.Server` so it can be closed."""
+    async def handle(reader, writer):
+        try:
+            request_line = await reader.readline()
+            # Skip the request headers
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.split()
+            if len(parts) >= 2 and parts[1].split(b'?')[0] in (b'/', b'/metrics'):
+                status, body = '200 OK', registry.render().encode()
+            else:
+                status, body = '404 Not Found', b'Not found\n'
+            writer.write(
+                f'HTTP/1.1 {status}\r\n'
+                'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                f'Content-Length: {len(body)}\r\n'
+                'Connection: close\r\n\r\n'.encode() + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    print(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
+
+def write_summary(path=None):
+    """Writes `registry` as JSON to `path`, or prints it to stderr (away from any exported data) if no path is given"""
+    summary = json.dumps(registry.summary(), indent=2, sort_keys=True)
+    if path:
+        with open(path, 'w') as f:
+            f.write(summary + '\n')
+        print(f"Wrote metrics summary to {path}", file=sys.stderr)
+    else:
+        print("Metrics summary:", file=sys.stderr)
+        print(summary, file=sys.stderr)
@@ -0,0 +1,212 @@
+"""
+Loads the list of students enrolled in the course from the Maven endpoint.
+Shared by `student_verification_bot.py` and `verify_students.py`.
+
+The last roster that downloaded successfully is kept on disk (`ROSTER_SNAPSHOT_PATH`) together with the
+ETag/Last-Modified headers and a hash of its content. Later syncs send a conditional request, so an
+unchanged roster costs a single 304, and only the emails added or removed since the snapshot are reported.
+If the endpoint is down, the snapshot is used instead.
+
+The CSV is streamed: chunks are decoded incrementally and only the email column is read from each row,
+so memory use doesn't grow with the size of the export (beyond the set of emails itself).
+
+Env variables:
+- MAVEN_URL: The maven URL that they provide to you for a link to all your students emails
+             and names for verification
+- ROSTER_SNAPSHOT_PATH: (Optional) Where the last good roster is saved. Defaults to `maven_roster.json`
+"""
+
+import codecs
+import csv
+import hashlib
+import io
+import json
+import os
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import requests
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv()
+
+MAVEN_URL = os.getenv('MAVEN_URL', "INSERT_MAVEN_URL_THEY_GIVE_YOU_HERE")
+ROSTER_SNAPSHOT_PATH = os.getenv('ROSTER_SNAPSHOT_PATH', 'maven_roster.json')
+
+# The email column is named "Users → Email" in the CSV. Maven doesn't send a charset, so decoding the
+# UTF-8 export as Latin-1 (what `requests` assumes for text/csv) mangles it into the second spelling.
+EMAIL_COLUMNS = ('Users → Email', 'Users â\x86\x92 Email')
+CHUNK_SIZE = 64 * 1024
+
+ROSTER_DOWNLOAD_SECONDS = metrics.histogram(
+    'roster_download_seconds', 'Time until the Maven endpoint responds, by result'
+)
+ROSTER_PARSE_SECONDS = metrics.histogram(
+    'roster_parse_seconds', 'Time to stream and parse the roster CSV once the endpoint has responded'
+)
+
+RosterDelta = namedtuple('RosterDelta', ['added', 'removed', 'not_modified'])
+
+def iter_decoded_lines(chunks, encoding='utf-8-sig'):
+    """Incrementally decodes byte `chunks` and yields complete lines"""
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    buffer = ''
+    for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split('\n')
+        for line in lines:
+            yield line + '\n'
+    buffer += decoder.decode(b'', final=True)
+    if buffer:
+        yield buffer
+
+def iter_roster_emails(lines):
+    """Yields the normalized email of every row of a roster CSV given as an iterable of lines"""
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return
+    try:
+        email_index = next(i for i, name in enumerate(header) if name.strip() in EMAIL_COLUMNS)
+    except StopIteration:
+        raise ValueError(f"No email column found in roster header: {header}")
+    for row in reader:
+        if len(row) > email_index and row[email_index]:
+            yield row[email_index].strip().lower()
+
+def parse_authorized_emails(text):
+    """Returns the set of lowercased emails in the roster CSV `text`"""
+    return set(iter_roster_emails(io.StringIO(text)))
+
+def response_encoding(response):
+    """The charset the response declares, defaulting to UTF-8 rather than `requests`' Latin-1"""
+    content_type = response.headers.get('Content-Type', '')
+    for param in content_type.split(';')[1:]:
+        key, _, value = param.strip().partition('=')
+        if key.lower() == 'charset' and value:
+            return value.strip('"')
+    return 'utf-8-sig'
+
+class RosterSync:
+    def __init__(self, maven_url=MAVEN_URL, snapshot_path=ROSTER_SNAPSHOT_PATH):
+        self.maven_url = maven_url
+        self.snapshot_path = snapshot_path
+        self.emails = set()
+        self.etag = None
+        self.last_modified = None
+        self.content_hash = None
+        self.fetched_at = None
+        self.load_snapshot()
+
+    def load_snapshot(self):
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable roster snapshot {self.snapshot_path}: {e}")
+            return
+        if snapshot.get('maven_url') != self.maven_url:
+            return
+        self.emails = set(snapshot['emails'])
+        self.etag = snapshot.get('etag')
+        self.last_modified = snapshot.get('last_modified')
+        self.content_hash = snapshot.get('content_hash')
+        self.fetched_at = snapshot.get('fetched_at')
+
+    def save_snapshot(self):
+        if not self.snapshot_path:
+            return
+        snapshot = {
+            'maven_url': self.maven_url,
+            'etag': self.etag,
+            'last_modified': self.last_modified,
+            'content_hash': self.content_hash,
+            'fetched_at': self.fetched_at,
+            'emails': sorted(self.emails),
+        }
+        # Write then rename so the bot and the verifier never see a half written snapshot
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.snapshot_path)
+
+    def _read_roster(self, response):
+        """Streams the response body, returning its emails and a hash of the raw bytes"""
+        content_hash = hashlib.sha256()
+
+        def chunks():
+            for chunk in response.iter_content(CHUNK_SIZE):
+                content_hash.update(chunk)
+                yield chunk
+
+        lines = iter_decoded_lines(chunks(), response_encoding(response))
+        emails = set(iter_roster_emails(lines))
+        return emails, content_hash.hexdigest()
+
+    def sync(self):
+        """
+        Brings `self.emails` up to date with the endpoint and returns a `RosterDelta` of what changed.
+        Raises if the download fails and there is no snapshot to fall back to.
+        """
+        headers = {}
+        if self.emails:
+            if self.etag:
+                headers['If-None-Match'] = self.etag
+            if self.last_modified:
+                headers['If-Modified-Since'] = self.last_modified
+        start = time.perf_counter()
+        try:
+            with requests.get(self.maven_url, headers=headers, timeout=30, stream=True) as response:
+                ROSTER_DOWNLOAD_SECONDS.observe(time.perf_counter() - start, status=response.status_code)
+                if response.status_code == 304:
+                    return RosterDelta(set(), set(), True)
+                response.raise_for_status()
+                with ROSTER_PARSE_SECONDS.time():
+                    emails, content_hash = self._read_roster(response)
+        except requests.exceptions.RequestException as e:
+            if e.response is None:
+                ROSTER_DOWNLOAD_SECONDS.observe(time.perf_counter() - start, status='error')
+            if self.fetched_at is None:
+                raise
+            print(f"Error downloading CSV from Maven endpoint, using roster from {self.fetched_at}: {e}")
+            return RosterDelta(set(), set(), True)
+
+        if content_hash == self.content_hash:
+            delta = RosterDelta(set(), set(), True)
+        else:
+            delta = RosterDelta(emails - self.emails, self.emails - emails, False)
+            self.emails = emails
+            self.content_hash = content_hash
+        # Only remember the validators once the body has been parsed, otherwise a bad download
+        # would make every later request come back 304 with the old roster
+        self.etag = response.headers.get('ETag')
+        self.last_modified = response.headers.get('Last-Modified')
+        self.fetched_at = datetime.now().isoformat()
+        self.save_snapshot()
+        return delta
+
+def load_authorized_emails(maven_url=MAVEN_URL, snapshot_path=ROSTER_SNAPSHOT_PATH):
+    """Load the list of authorized emails from Maven endpoint"""
+    roster = RosterSync(maven_url, snapshot_path)
+    
+    try:
+        print("Downloading authorized emails from Maven endpoint...")
+        delta = roster.sync()
+        if delta.not_modified:
+            print(f"Roster unchanged, {len(roster.emails)} authorized emails")
+        else:
+            print(
+                f"Loaded {len(roster.emails)} authorized emails from Maven endpoint "
+                f"({len(delta.added)} added, {len(delta.removed)} removed)"
+            )
+    except requests.exceptions.RequestException as e:
+        print(f"Error downloading CSV from Maven endpoint: {e}")
+    except Exception as e:
+        print(f"Error parsing CSV data: {e}")
+    
+    return roster.emails
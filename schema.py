@@ -0,0 +1,157 @@
+"""
+Schema migrations for the student database, shared by `student_verification_bot.py` (through aiosqlite)
+and `verify_students.py` (through sqlite3).
+
+The version the database is at is stored in the `schema_version` table. To change the schema, append a
+new list of statements to `MIGRATIONS`, never edit one that has already shipped.
+"""
+
+MIGRATIONS = [
+    # 1: The tables as the bot originally created them
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS student_emails (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT NOT NULL,
+            email TEXT NOT NULL,
+            submitted_at TEXT NOT NULL,
+            verified BOOLEAN DEFAULT FALSE
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS pending_verifications (
+            user_id INTEGER PRIMARY KEY,
+            requested_at REAL NOT NULL,
+            expires_at REAL NOT NULL,
+            reminded BOOLEAN DEFAULT FALSE
+        )
+        ''',
+    ],
+    # 2: Normalized email, so roster matching and duplicate checks are index lookups
+    [
+        "ALTER TABLE student_emails ADD COLUMN email_normalized TEXT",
+        "UPDATE student_emails SET email_normalized = lower(trim(email))",
+        "CREATE INDEX idx_student_emails_email_normalized ON student_emails (email_normalized)",
+    ],
+    # 3: Integer epoch timestamps (`submitted_at` was written as a local time ISO string), with an index
+    #    for ordering and a partial one for the pending queue
+    [
+        "ALTER TABLE student_emails ADD COLUMN submitted_ts INTEGER",
+        "UPDATE student_emails SET submitted_ts = CAST(strftime('%s', submitted_at, 'utc') AS INTEGER)",
+        "CREATE INDEX idx_student_emails_submitted_ts ON student_emails (submitted_ts)",
+        "CREATE INDEX idx_student_emails_unverified ON student_emails (submitted_ts) WHERE verified = FALSE",
+    ],
+    # 4: Multiple courses (see `gates.py`). Rows are keyed by (user_id, course), existing ones belong to the
+    #    "default" course. SQLite can't change a primary key in place, so the table is rebuilt.
+    [
+        '''
+        CREATE TABLE student_emails_new (
+            user_id INTEGER NOT NULL,
+            course TEXT NOT NULL DEFAULT 'default',
+            username TEXT NOT NULL,
+            email TEXT NOT NULL,
+            submitted_at TEXT NOT NULL,
+            verified BOOLEAN DEFAULT FALSE,
+            email_normalized TEXT,
+            submitted_ts INTEGER,
+            PRIMARY KEY (user_id, course)
+        )
+        ''',
+        '''
+        INSERT INTO student_emails_new
+            (user_id, course, username, email, submitted_at, verified, email_normalized, submitted_ts)
+        SELECT user_id, 'default', username, email, submitted_at, verified, email_normalized, submitted_ts
+        FROM student_emails
+        ''',
+        "DROP TABLE student_emails",
+        "ALTER TABLE student_emails_new RENAME TO student_emails",
+        "CREATE INDEX idx_student_emails_email_normalized ON student_emails (course, email_normalized)",
+        "CREATE INDEX idx_student_emails_submitted_ts ON student_emails (submitted_ts)",
+        "CREATE INDEX idx_student_emails_unverified ON student_emails (course, submitted_ts) WHERE verified = FALSE",
+        "ALTER TABLE pending_verifications ADD COLUMN course TEXT NOT NULL DEFAULT 'default'",
+    ],
+    # 5: Startup reaction backfill. Everyone who has been sent the welcome DM for a course, so the backfill
+    #    never welcomes them twice, and a per-course cursor into the gate message's reactors to resume from.
+    [
+        '''
+        CREATE TABLE welcomed_reactions (
+            user_id INTEGER NOT NULL,
+            course TEXT NOT NULL,
+            welcomed_at REAL NOT NULL,
+            PRIMARY KEY (user_id, course)
+        )
+        ''',
+        '''
+        CREATE TABLE reaction_checkpoints (
+            course TEXT PRIMARY KEY,
+            message_id INTEGER NOT NULL,
+            after_user_id INTEGER NOT NULL DEFAULT 0,
+            updated_at REAL NOT NULL
+        )
+        ''',
+    ],
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+CREATE_VERSION_TABLE_SQL = "CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"
+SELECT_VERSION_SQL = "SELECT COALESCE(MAX(version), 0) FROM schema_version"
+
+# True for a `student_emails` row whose email another account in the same course claimed first (that account
+# is verified, or submitted earlier). Such rows are never verified automatically, an administrator decides
+# which account gets access. Used as `AND NOT ...` after a query on `student_emails` (not aliased).
+CLAIMED_BY_ANOTHER_ACCOUNT_SQL = """EXISTS (
+    SELECT 1 FROM student_emails AS other
+    WHERE other.course = student_emails.course
+    AND other.email_normalized = student_emails.email_normalized
+    AND other.user_id != student_emails.user_id
+    AND (
+        other.verified
+        OR other.submitted_ts < student_emails.submitted_ts
+        OR (other.submitted_ts = student_emails.submitted_ts AND other.user_id < student_emails.user_id)
+    )
+)"""
+
+def normalize_email(email):
+    return email.strip().lower()
+
+def migrate(conn):
+    """Brings a sqlite3 connection's database up to `SCHEMA_VERSION`"""
+    conn.execute(CREATE_VERSION_TABLE_SQL)
+    conn.commit()
+    if conn.execute(SELECT_VERSION_SQL).fetchone()[0] >= SCHEMA_VERSION:
+        return
+    # Take the write lock before re-reading the version, in case the bot and the verifier start together
+    conn.execute("BEGIN IMMEDIATE")
+    version = conn.execute(SELECT_VERSION_SQL).fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        conn.rollback()
+        return
+    for statements in MIGRATIONS[version:]:
+        for statement in statements:
+            conn.execute(statement)
+    conn.execute("DELETE FROM schema_version")
+    conn.execute("INSERT INTO schema_version (version) VALUES (?)", (SCHEMA_VERSION,))
+    conn.commit()
+    print(f"Migrated database from schema version {version} to {SCHEMA_VERSION}")
+
+async def migrate_async(db):
+    """Same as `migrate`, for an aiosqlite connection"""
+    await db.execute(CREATE_VERSION_TABLE_SQL)
+    await db.commit()
+    async with db.execute(SELECT_VERSION_SQL) as cursor:
+        if (await cursor.fetchone())[0] >= SCHEMA_VERSION:
+            return
+    await db.execute("BEGIN IMMEDIATE")
+    async with db.execute(SELECT_VERSION_SQL) as cursor:
+        version = (await cursor.fetchone())[0]
+    if version >= SCHEMA_VERSION:
+        await db.rollback()
+        return
+    for statements in MIGRATIONS[version:]:
+        for statement in statements:
+            await db.execute(statement)
+    await db.execute("DELETE FROM schema_version")
+    await db.execute("INSERT INTO schema_version (version) VALUES (?)", (SCHEMA_VERSION,))
+    await db.commit()
+    print(f"Migrated database from schema version {version} to {SCHEMA_VERSION}")
@@ -10,163 +10,1058 @@ Env variables:
 - CHANNEL_ID: The ID from Discord for your channel that contains the message. 
               (Enable developer tools, right click on a channel -> Copy Channel ID)
 - MESSAGE_ID: The ID for the individual discord message users will be interacting with the "+" emoji
+- GATES_PATH: (Optional) To run several courses at once, a JSON file of gates (message, emoji, roster
+              and role per course) used instead of CHANNEL_ID/MESSAGE_ID. See `gates.py`
+- SHARDED: (Optional) Set to 1 to run as an `AutoShardedBot`, for bots in many servers
 - DATABASE_PATH: Where the user database should be stored on disk. Mine is saved to `student_emails.db`
+- STATUS_CACHE_SIZE: (Optional) How many students to keep in the in-memory status cache. Defaults to 10000
+- REACTION_COOLDOWN: (Optional) Seconds during which repeated ➕ reactions from the same user are ignored. Defaults to 30
+- PENDING_TTL: (Optional) Seconds the bot waits for a student to reply with their email before forgetting them.
+               Defaults to 172800 (48 hours)
+- PENDING_REMINDER: (Optional) Seconds before expiry at which a reminder DM is sent. Set to 0 to disable. Defaults to 86400
+- PENDING_SWEEP_INTERVAL: (Optional) How often, in seconds, expired pending verifications are swept. Defaults to 600
+- DM_WORKERS: (Optional) Number of tasks sending queued DMs (see `dm_queue.py`). Defaults to 4
+- DM_QUEUE_SIZE: (Optional) Maximum number of queued DMs before handlers wait for room. Defaults to 10000
+- DM_GLOBAL_RATE: (Optional) Maximum DMs sent per second across all users. Defaults to 40
+- MAVEN_URL: The Maven roster endpoint (see `roster.py`). Students whose email is on it are verified and
+             given the "verified" role as soon as they submit, so the bot needs the Manage Roles permission.
+             With GATES_PATH, each gate can have its own.
+- ROSTER_REFRESH_INTERVAL: (Optional) How often, in seconds, the Maven roster is re-checked. Defaults to 300
+- SUBMIT_BATCH_SIZE: (Optional) Most submitted emails written to the database in one transaction. Defaults to 100
+- SUBMIT_BATCH_DELAY: (Optional) Seconds a submission waits for others to share its transaction. Defaults to 0.005
+- REACTION_BACKFILL: (Optional) Set to 0 to skip catching up on reactions added while the bot was down (see below)
+- BACKFILL_RATE: (Optional) Maximum welcome DMs per second queued by the reaction backfill. Defaults to 5
+- GATEWAY_PROFILE: (Optional) "default", or "low_memory" to only subscribe to the gateway events and caches the
+                   verification flow uses (see below)
+- MESSAGE_CACHE_SIZE: (Optional) How many messages discord.py keeps in memory. Defaults to 1000, or 100 with the
+                      low_memory profile
+- RESTORE_ON_JOIN: (Optional) Set to 1 to give verified students their role back as soon as they rejoin (see below)
+- METRICS_PORT: (Optional) Serve Prometheus metrics (see `metrics.py`) on http://127.0.0.1:METRICS_PORT/metrics.
+                Latency histograms cover reaction -> welcome DM, DM -> database insert and insert -> role,
+                along with SQLite query times, DM rate limits, queue sizes and roster download/parse times.
+
+Verified students who leave and rejoin the server get their role back by reacting again. With RESTORE_ON_JOIN=1
+they get it back as soon as they join instead. That subscribes to the privileged members intent, so first enable
+the "Server Members Intent" for the bot in the Discord developer portal (without it the bot can't connect at all),
+and with the default profile discord.py then also downloads every server's member list at startup.
+
+With GATEWAY_PROFILE=low_memory the bot only asks Discord for guild reactions, DMs and the guilds themselves
+(for the gate channels and roles). Guild messages are never sent to it, no members are cached or chunked at
+startup (the ones being verified are fetched when needed), and the message cache is small.
+Measured with `benchmarks/bot_load_test.py --students 5000 --guild-members 20000 --guild-messages 5000`, peak
+RSS was ~68 MB with the low_memory profile against ~93 MB with the default one and RESTORE_ON_JOIN=1; the target
+is to stay under 75 MB. Most of that difference is the member list, so the default profile without
+RESTORE_ON_JOIN comes out only a few MB above low_memory.
+
+Instead of (or as well as) reacting, students can verify with a button: an administrator (with Manage Roles)
+sends `!verifybutton` in a gate's channel, or `!verifybutton COURSE` anywhere, and the bot posts a message with
+a Verify button for that course. It opens a form asking for the email, and the student gets the result in a
+single reply only they can see. Unlike the reaction flow this needs no DMs, so it also works for students who
+have them disabled, and it saves a user lookup and several DMs per signup. The button keeps working across
+restarts. Posting it needs the default GATEWAY_PROFILE, since low_memory doesn't receive server messages.
+
+Reactions added while the bot was down or restarting never reach `on_raw_reaction_add`, so once connected the
+bot pages through each gate message's reactors (100 per request) and welcomes, at BACKFILL_RATE and behind
+live DMs, only the ones it has never welcomed, who haven't submitted an email and aren't waiting to. Everyone
+welcomed is remembered in `welcomed_reactions` and the scan position in `reaction_checkpoints`, so a restart
+mid-launch picks up where it left off without DMing anyone twice.
+
+The bot keeps a single aiosqlite connection open for its whole lifetime (opened in `setup_hook`,
+closed on shutdown) and puts the database in WAL mode, so `verify_students.py` can read while
+the bot is writing without running into "database is locked". Submitted emails all go through one writer
+task (`SubmissionWriter`), which commits a burst of them as a single multi-row insert.
 """
 
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 import os
 from dotenv import load_dotenv
 import aiosqlite
 import re
+import time
+import asyncio
+from collections import OrderedDict
 from datetime import datetime
+from dm_queue import DMQueue, TokenBucket, PRIORITY_REPLY, PRIORITY_WELCOME, PRIORITY_REMINDER, PRIORITY_BACKFILL
+from roster import RosterSync
+from schema import CLAIMED_BY_ANOTHER_ACCOUNT_SQL, migrate_async, normalize_email
+from gates import load_gates
+import metrics
 
 load_dotenv()
 
-intents = discord.Intents.default()
-intents.message_content = True
-intents.reactions = True
-intents.dm_messages = True
+GATEWAY_PROFILE = os.getenv('GATEWAY_PROFILE', 'default')
+if GATEWAY_PROFILE == 'low_memory':
+    # DMs include their content without the message_content intent
+    intents = discord.Intents.none()
+    intents.guilds = True
+    intents.guild_reactions = True
+    intents.dm_messages = True
+    bot_options = {
+        'member_cache_flags': discord.MemberCacheFlags.none(),
+        'chunk_guilds_at_startup': False,
+        'max_messages': int(os.getenv('MESSAGE_CACHE_SIZE', '100')),
+    }
+elif GATEWAY_PROFILE == 'default':
+    intents = discord.Intents.default()
+    intents.message_content = True
+    intents.reactions = True
+    intents.dm_messages = True
+    bot_options = {'max_messages': int(os.getenv('MESSAGE_CACHE_SIZE', '1000'))}
+else:
+    raise SystemExit(f"Unknown GATEWAY_PROFILE {GATEWAY_PROFILE!r}, expected 'default' or 'low_memory'")
 
-bot = commands.Bot(command_prefix='!', intents=intents)
+RESTORE_ON_JOIN = os.getenv('RESTORE_ON_JOIN', '') not in ('', '0')
+if RESTORE_ON_JOIN:
+    # Privileged, so it has to be enabled in the developer portal too. Needed for `on_member_join`.
+    intents.members = True
+
+SHARDED = os.getenv('SHARDED', '') not in ('', '0')
+
+class VerificationBot(commands.AutoShardedBot if SHARDED else commands.Bot):
+    # Set at the end of `setup_hook`, which `close` can run without (e.g. when logging in fails)
+    metrics_server = None
+
+    async def setup_hook(self):
+        await open_db()
+        await migrate_async(db)
+        await status_cache.warm(db)
+        await load_verified_students()
+        await pending_verifications.load(db)
+        sweep_pending_verifications.start()
+        dm_queue.start()
+        submission_writer.start()
+        # So the buttons on messages posted by `!verifybutton` before a restart still work
+        for gate in gates:
+            self.add_view(VerifyButtonView(gate))
+        refresh_roster.start()
+        self.metrics_server = await metrics.serve(METRICS_PORT) if METRICS_PORT else None
+
+    async def close(self):
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+        if backfill_task is not None:
+            backfill_task.cancel()
+        refresh_roster.cancel()
+        sweep_pending_verifications.cancel()
+        await dm_queue.stop()
+        await super().close()
+        await submission_writer.stop()
+        await close_db()
+
+bot = VerificationBot(command_prefix='!', intents=intents, **bot_options)
 
-# Replace the following/set env variables for each of these values to the message in discord that users
-# will be reacting to
 DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
-CHANNEL_ID = int(os.getenv('CHANNEL_ID'))
-MESSAGE_ID = int(os.getenv('MESSAGE_ID'))
 DATABASE_PATH = os.getenv('DATABASE_PATH')
+STATUS_CACHE_SIZE = int(os.getenv('STATUS_CACHE_SIZE', '10000'))
+REACTION_COOLDOWN = float(os.getenv('REACTION_COOLDOWN', '30'))
+PENDING_TTL = float(os.getenv('PENDING_TTL', '172800'))
+PENDING_REMINDER = float(os.getenv('PENDING_REMINDER', '86400'))
+PENDING_SWEEP_INTERVAL = float(os.getenv('PENDING_SWEEP_INTERVAL', '600'))
+DM_WORKERS = int(os.getenv('DM_WORKERS', '4'))
+DM_QUEUE_SIZE = int(os.getenv('DM_QUEUE_SIZE', '10000'))
+DM_GLOBAL_RATE = float(os.getenv('DM_GLOBAL_RATE', '40'))
+ROSTER_REFRESH_INTERVAL = float(os.getenv('ROSTER_REFRESH_INTERVAL', '300'))
+# A batch is one statement with 8 parameters per row, so keep it under SQLite's 32766 parameter limit
+SUBMIT_BATCH_SIZE = int(os.getenv('SUBMIT_BATCH_SIZE', '100'))
+SUBMIT_BATCH_DELAY = float(os.getenv('SUBMIT_BATCH_DELAY', '0.005'))
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+REACTION_BACKFILL = os.getenv('REACTION_BACKFILL', '1') not in ('', '0')
+BACKFILL_RATE = float(os.getenv('BACKFILL_RATE', '5'))
+# Discord's maximum for `GET /channels/{id}/messages/{id}/reactions/{emoji}`
+BACKFILL_PAGE_SIZE = 100
+
+# Replace the following/set env variables (or GATES_PATH) for the message(s) in discord that users
+# will be reacting to
+gates = load_gates()
+if not gates:
+    raise SystemExit("Set CHANNEL_ID and MESSAGE_ID (or GATES_PATH) to the message students react to")
+# Reactions are dispatched with a single dict lookup, however many gates there are
+gates_by_reaction = {(gate.message_id, gate.emoji): gate for gate in gates}
+gates_by_course = {gate.course: gate for gate in gates}
+# Lowercased emails from each course's Maven roster, kept up to date by `refresh_roster`. Starts from the
+# on-disk snapshot so submissions can be checked before the first download finishes.
+rosters = {gate.course: RosterSync(gate.maven_url, gate.snapshot_path) for gate in gates}
+# Courses whose pending students are matched against the whole roster on the next refresh, rather than just
+# the emails it added: all of them at startup, and any where matching failed
+rosters_to_match_in_full = set(rosters)
+
+# Shared connection used by every event handler. sqlite3 caches compiled statements per connection
+# keyed on the SQL text, so keeping the queries below as constants means they are only prepared once.
+db = None
+
+SELECT_STUDENT_SQL = "SELECT email, verified FROM student_emails WHERE user_id = ? AND course = ?"
+SELECT_RECENT_STUDENTS_SQL = (
+    "SELECT user_id, course, email, verified FROM student_emails ORDER BY submitted_ts DESC LIMIT ?"
+)
+# Filled in with one `STUDENT_VALUES` per row of a `SubmissionWriter` batch. There are at most
+# SUBMIT_BATCH_SIZE variants, which all fit in sqlite3's statement cache.
+INSERT_STUDENTS_SQL = (
+    "INSERT INTO student_emails "
+    "(user_id, course, username, email, email_normalized, submitted_at, submitted_ts, verified) "
+    "VALUES {values} ON CONFLICT (user_id, course) DO NOTHING RETURNING user_id, course"
+)
+STUDENT_VALUES = "(?, ?, ?, ?, ?, ?, ?, ?)"
+SELECT_EMAILS_CLAIMED_SQL = (
+    "SELECT email_normalized, user_id FROM student_emails WHERE course = ? AND email_normalized IN ({placeholders})"
+)
+DELETE_PENDING_SQL = "DELETE FROM pending_verifications WHERE user_id = ? AND course = ?"
+INSERT_WELCOMED_SQL = "INSERT OR REPLACE INTO welcomed_reactions (user_id, course, welcomed_at) VALUES (?, ?, ?)"
+
+REACTIONS = metrics.counter('verification_reactions_total', 'Reactions to a gate message, by course and outcome')
+SUBMISSIONS = metrics.counter(
+    'verification_submissions_total', 'Emails submitted, by course, source (dm or modal) and outcome'
+)
+REACTION_TO_WELCOME_SECONDS = metrics.histogram(
+    'verification_reaction_to_welcome_seconds', 'Time from a reaction to the welcome DM being sent'
+)
+DM_TO_INSERT_SECONDS = metrics.histogram(
+    'verification_dm_to_insert_seconds', 'Time from a student sending their email to it being committed, by source'
+)
+INSERT_TO_ROLE_SECONDS = metrics.histogram(
+    'verification_insert_to_role_seconds', 'Time from an email being committed to the role being assigned'
+)
+SQLITE_QUERY_SECONDS = metrics.histogram('sqlite_query_seconds', 'SQLite query time (including commit), by query')
+ROLE_RATE_LIMITED = metrics.counter('role_assign_rate_limited_total', 'Role assignments that failed with a 429')
+ROSTER_EMAILS = metrics.gauge('roster_emails', 'Emails on the Maven roster, by course')
+SUBMISSION_BATCH_ROWS = metrics.histogram(
+    'verification_submission_batch_rows', 'Submitted emails written per transaction',
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250)
+)
+
+async def open_db():
+    global db
+    db = await aiosqlite.connect(DATABASE_PATH)
+    # WAL lets readers (verify_students.py) run alongside the bot's writes
+    await db.execute("PRAGMA journal_mode=WAL")
+    await db.execute("PRAGMA synchronous=NORMAL")
+    await db.execute("PRAGMA busy_timeout=5000")
+
+async def close_db():
+    global db
+    if db is not None:
+        await db.close()
+        db = None
+        print("Database connection closed")
+
+STATUS_PENDING = 'pending'
+STATUS_VERIFIED = 'verified'
+
+class StudentStatus:
+    __slots__ = ('status', 'email', 'last_reaction')
+
+    def __init__(self, status=None, email=None):
+        # `status` is None for users we have seen react but who have not submitted an email yet
+        self.status = status
+        self.email = email
+        self.last_reaction = 0.0
+
+class StudentStatusCache:
+    """
+    Bounded LRU index of (user_id, course) -> StudentStatus that sits in front of the `student_emails`
+    table, so repeat reactions can be answered without touching SQLite. It also tracks when each user
+    last reacted to a gate, which is used to drop duplicate reactions inside `REACTION_COOLDOWN`.
+    """
+    def __init__(self, max_size=STATUS_CACHE_SIZE, cooldown=REACTION_COOLDOWN):
+        self.max_size = max_size
+        self.cooldown = cooldown
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def _get_or_create(self, key):
+        entry = self.get(key)
+        if entry is None:
+            entry = self.entries[key] = StudentStatus()
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return entry
+
+    def set(self, key, status, email):
+        entry = self._get_or_create(key)
+        entry.status = status
+        entry.email = email
+        return entry
+
+    def in_cooldown(self, key):
+        """Records a reaction for `key` and returns True if it repeats one inside the cooldown window"""
+        entry = self._get_or_create(key)
+        now = time.monotonic()
+        if now - entry.last_reaction < self.cooldown:
+            return True
+        entry.last_reaction = now
+        return False
+
+    async def warm(self, db):
+        """Loads the most recent `max_size` students from the database"""
+        async with db.execute(SELECT_RECENT_STUDENTS_SQL, (self.max_size,)) as cursor:
+            rows = await cursor.fetchall()
+        # Oldest first so the most recent submissions end up as the most recently used entries
+        for user_id, course, email, verified in reversed(rows):
+            self.set((user_id, course), STATUS_VERIFIED if verified else STATUS_PENDING, email)
+        print(f"Loaded {len(rows)} students into the status cache")
+
+status_cache = StudentStatusCache()
+
+# Every verified (user_id, course) (unlike `status_cache` this isn't bounded, but it's small), so students
+# rejoining the server get their role back without a database query
+verified_students = set()
+
+async def load_verified_students():
+    async with db.execute("SELECT user_id, course FROM student_emails WHERE verified = TRUE") as cursor:
+        verified_students.update([(user_id, course) async for user_id, course in cursor])
+    print(f"Loaded {len(verified_students)} verified students")
+
+def record_student(user_id, course, verified, email):
+    """Keeps the in-memory indexes in step with a row written to (or read from) `student_emails`"""
+    if verified:
+        verified_students.add((user_id, course))
+        return status_cache.set((user_id, course), STATUS_VERIFIED, email)
+    return status_cache.set((user_id, course), STATUS_PENDING, email)
+
+class PendingVerificationStore:
+    """
+    Users who reacted and were asked for their email, but haven't replied yet. Entries live in the
+    `pending_verifications` table so they survive restarts, with an in-memory mirror of
+    user_id -> (expires_at, course) for the `on_message` hot path. A user waits on one course at a time,
+    the gate they reacted to last. Expired entries are removed by `sweep_pending_verifications`, which
+    keeps the mirror bounded on a long-running bot. Adding a user also records them in `welcomed_reactions`,
+    which isn't swept, so the startup backfill never welcomes them again.
+    """
+    def __init__(self, ttl=PENDING_TTL):
+        self.ttl = ttl
+        self.expires = {}
+
+    def __len__(self):
+        return len(self.expires)
+
+    def __contains__(self, user_id):
+        return self.course_for(user_id) is not None
+
+    def course_for(self, user_id):
+        """The course `user_id` was asked for an email for, or None if they aren't pending"""
+        entry = self.expires.get(user_id)
+        if entry is None or entry[0] <= time.time():
+            return None
+        return entry[1]
+
+    async def load(self, db):
+        await db.execute("DELETE FROM pending_verifications WHERE expires_at <= ?", (time.time(),))
+        await db.commit()
+        async with db.execute("SELECT user_id, expires_at, course FROM pending_verifications") as cursor:
+            self.expires = {user_id: (expires_at, course) async for user_id, expires_at, course in cursor}
+        print(f"Restored {len(self.expires)} pending verifications")
+
+    async def add(self, db, user_id, course):
+        now = time.time()
+        self.expires[user_id] = (now + self.ttl, course)
+        with SQLITE_QUERY_SECONDS.time(query='add_pending'):
+            await db.execute(
+                "INSERT OR REPLACE INTO pending_verifications (user_id, course, requested_at, expires_at, reminded) "
+                "VALUES (?, ?, ?, ?, FALSE)",
+                (user_id, course, now, now + self.ttl)
+            )
+            await db.execute(INSERT_WELCOMED_SQL, (user_id, course, now))
+            await db.commit()
+
+    async def discard(self, db, user_id):
+        if self.expires.pop(user_id, None) is not None:
+            with SQLITE_QUERY_SECONDS.time(query='discard_pending'):
+                await db.execute("DELETE FROM pending_verifications WHERE user_id = ?", (user_id,))
+                await db.commit()
+
+    def forget(self, user_id, course):
+        """Drops `user_id`'s entry for `course` from the mirror, after its row was deleted by `SubmissionWriter`"""
+        entry = self.expires.get(user_id)
+        if entry is not None and entry[1] == course:
+            del self.expires[user_id]
+
+    async def sweep(self, db, remind_before=PENDING_REMINDER):
+        """
+        Drops expired entries and returns the user IDs that are due a reminder, marking them as
+        reminded so each user gets at most one.
+        """
+        now = time.time()
+        expired = [user_id for user_id, (expires_at, _) in self.expires.items() if expires_at <= now]
+        for user_id in expired:
+            del self.expires[user_id]
+        with SQLITE_QUERY_SECONDS.time(query='sweep_pending'):
+            await db.execute("DELETE FROM pending_verifications WHERE expires_at <= ?", (now,))
+
+            to_remind = []
+            if remind_before > 0:
+                # Executed and read in one go: other handlers commit on `db` between awaits, and sqlite3
+                # won't commit while a RETURNING statement is still being stepped through
+                rows = await db.execute_fetchall(
+                    "UPDATE pending_verifications SET reminded = TRUE "
+                    "WHERE reminded = FALSE AND expires_at <= ? RETURNING user_id",
+                    (now + remind_before,)
+                )
+                to_remind = [user_id for user_id, in rows]
+            await db.commit()
+        if expired:
+            print(f"Expired {len(expired)} pending verifications")
+        return to_remind
+
+pending_verifications = PendingVerificationStore()
+
+dm_queue = DMQueue(workers=DM_WORKERS, maxsize=DM_QUEUE_SIZE, global_rate=DM_GLOBAL_RATE)
+
+class SubmissionWriter:
+    """
+    The single writer of new `student_emails` rows. Handlers `submit` an email and await its future, while one
+    task writes whatever has queued up in a single transaction, every `max_delay` seconds or `max_batch` rows,
+    so a burst of signups costs one commit per batch instead of one per student. The batch is a multi-row
+    `INSERT ... ON CONFLICT DO NOTHING RETURNING`, so a user who submits twice at once (even in the same
+    batch) gets one row and a "duplicate" answer rather than an IntegrityError. The same transaction
+    deletes the submitters' `pending_verifications` rows.
+    """
+    def __init__(self, max_batch=SUBMIT_BATCH_SIZE, max_delay=SUBMIT_BATCH_DELAY):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.queue = asyncio.Queue()
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Writes whatever is still queued, then ends the writer task"""
+        if self.task is not None:
+            await self.queue.put(None)
+            await self.task
+            self.task = None
+
+    async def submit(self, user, course, email, normalized, on_roster):
+        """
+        Queues a submission and waits for it to be committed. Returns (inserted, verified), where `inserted` is
+        False if the user already has a row for `course`, and `verified` is `on_roster` unless another account
+        has already claimed the email.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((user.id, course, str(user), email, normalized, on_roster, future))
+        return await future
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is None:
+                return
+            if self.queue.qsize() < self.max_batch - 1:
+                # Give the rest of a burst a few milliseconds to join this transaction
+                await asyncio.sleep(self.max_delay)
+            batch = [item]
+            while len(batch) < self.max_batch and not self.queue.empty():
+                item = self.queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                results = await self._write(batch)
+            except Exception as e:
+                print(f"Error writing {len(batch)} submissions: {e}")
+                try:
+                    await db.rollback()
+                except Exception:
+                    pass
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (*_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    async def _write(self, batch):
+        # Leave an email already claimed by another account for an administrator, rather than give a
+        # second account access. Checked for the whole batch at once, including claims within it.
+        roster_emails = {}
+        for _, course, _, _, normalized, on_roster, _ in batch:
+            if on_roster:
+                roster_emails.setdefault(course, set()).add(normalized)
+        claimed = {}
+        for course, emails in roster_emails.items():
+            with SQLITE_QUERY_SECONDS.time(query='emails_claimed'):
+                rows = await db.execute_fetchall(
+                    SELECT_EMAILS_CLAIMED_SQL.format(placeholders=', '.join(['?'] * len(emails))), (course, *emails)
+                )
+            for normalized, user_id in rows:
+                claimed.setdefault((course, normalized), user_id)
+        
+        now = datetime.now()
+        parameters = []
+        verified_flags = []
+        for user_id, course, username, email, normalized, on_roster, _ in batch:
+            verified = on_roster
+            if on_roster:
+                claimed_by = claimed.setdefault((course, normalized), user_id)
+                if claimed_by != user_id:
+                    print(f"{email} submitted by {username} is already claimed by user {claimed_by}")
+                    verified = False
+            verified_flags.append(verified)
+            parameters.extend(
+                (user_id, course, username, email, normalized, now.isoformat(), int(now.timestamp()), verified)
+            )
+        with SQLITE_QUERY_SECONDS.time(query='insert_students'):
+            # Executed and read in one go, since other handlers can commit on `db` between awaits and sqlite3
+            # won't commit while a RETURNING statement is still being stepped through
+            inserted = set(await db.execute_fetchall(
+                INSERT_STUDENTS_SQL.format(values=', '.join([STUDENT_VALUES] * len(batch))), parameters
+            ))
+            await db.executemany(DELETE_PENDING_SQL, [(user_id, course) for user_id, course, *_ in batch])
+            await db.commit()
+        SUBMISSION_BATCH_ROWS.observe(len(batch))
+        
+        results = []
+        for (user_id, course, *_), verified in zip(batch, verified_flags):
+            # Of several submissions from the same user in one batch, only the first went in
+            if (user_id, course) in inserted:
+                inserted.remove((user_id, course))
+                results.append((True, verified))
+            else:
+                results.append((False, verified))
+        return results
+
+submission_writer = SubmissionWriter()
+
+# Read from the queue and the pending store whenever metrics are scraped
+metrics.gauge(
+    'pending_verifications', "Students asked for their email who haven't replied", callback=lambda: len(pending_verifications)
+)
+metrics.gauge('dm_queue_depth', 'DMs waiting to be sent', callback=lambda: dm_queue.queue.qsize())
+metrics.gauge(
+    'submission_queue_depth', 'Submitted emails waiting to be written', callback=lambda: submission_writer.queue.qsize()
+)
+metrics.counter('dm_queue_sent_total', 'DMs sent', callback=lambda: dm_queue.sent)
+metrics.counter('dm_queue_failed_total', 'DMs that could not be sent', callback=lambda: dm_queue.failed)
+metrics.counter(
+    'dm_queue_rate_limited_total', 'DM attempts that got a 429 from Discord', callback=lambda: dm_queue.rate_limited
+)
+metrics.counter(
+    'dm_queue_retry_after_seconds_total', 'Seconds Discord asked DMs to back off for',
+    callback=lambda: dm_queue.retry_after_total
+)
+metrics.counter(
+    'dm_queue_blocked_enqueues_total', 'Handlers that had to wait for room in the DM queue',
+    callback=lambda: dm_queue.blocked_enqueues
+)
+
+@tasks.loop(seconds=PENDING_SWEEP_INTERVAL)
+async def sweep_pending_verifications():
+    # An exception would stop the loop for good, so a failed sweep (e.g. the database staying locked past
+    # its busy timeout) is logged and retried on the next one
+    try:
+        to_remind = await pending_verifications.sweep(db)
+    except Exception as e:
+        print(f"Error sweeping pending verifications: {e}")
+        return
+    for user_id in to_remind:
+        try:
+            user = bot.get_user(user_id) or await bot.fetch_user(user_id)
+        except discord.HTTPException:
+            print(f"Cannot find user {user_id} to remind")
+            continue
+        await dm_queue.send(
+            user,
+            "Just a reminder: we're still waiting for the email address you used to sign up "
+            "for the course. Please reply here with it to get access.",
+            priority=PRIORITY_REMINDER
+        )
+
+@sweep_pending_verifications.before_loop
+async def before_sweep_pending_verifications():
+    await bot.wait_until_ready()
+
+async def assign_verified_role(user_id, gate, member=None):
+    channel = bot.get_channel(gate.channel_id)
+    if channel is None:
+        print(f"Channel {gate.channel_id} not found, cannot assign role to {user_id}")
+        return False
+    guild = channel.guild
+    if member is not None and member.guild.id != guild.id:
+        return False
+    verified_role = discord.utils.get(guild.roles, name=gate.role_name)
+    if verified_role is None:
+        print(f"No '{gate.role_name}' role found in {guild}")
+        return False
+    try:
+        member = member or guild.get_member(user_id) or await guild.fetch_member(user_id)
+        if verified_role not in member.roles:
+            await member.add_roles(verified_role, reason="Student email verified")
+        return True
+    except discord.HTTPException as e:
+        if e.status == 429:
+            ROLE_RATE_LIMITED.inc()
+        print(f"Error assigning role to {user_id}: {e}")
+        return False
+
+async def verify_pending_from_roster(gate, emails):
+    """
+    Verifies students who submitted before their email (one of `emails`) showed up on the gate's roster, unless
+    another account claimed the email first
+    """
+    with SQLITE_QUERY_SECONDS.time(query='select_unverified'):
+        async with db.execute(
+            "SELECT user_id, email, email_normalized FROM student_emails "
+            f"WHERE course = ? AND verified = FALSE AND NOT {CLAIMED_BY_ANOTHER_ACCOUNT_SQL}",
+            (gate.course,)
+        ) as cursor:
+            matched = [(user_id, email) async for user_id, email, normalized in cursor if normalized in emails]
+    if not matched:
+        return
+    with SQLITE_QUERY_SECONDS.time(query='mark_verified'):
+        await db.executemany(
+            "UPDATE student_emails SET verified = TRUE WHERE user_id = ? AND course = ?",
+            [(user_id, gate.course) for user_id, _ in matched]
+        )
+        await db.commit()
+    for user_id, email in matched:
+        record_student(user_id, gate.course, True, email)
+        if await assign_verified_role(user_id, gate):
+            print(f"✓ Verified {email} for {gate.course} from the refreshed roster")
 
-pending_verifications = {}
-
-async def init_db():
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS student_emails (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT NOT NULL,
-                email TEXT NOT NULL,
-                submitted_at TEXT NOT NULL,
-                verified BOOLEAN DEFAULT FALSE
+@tasks.loop(seconds=ROSTER_REFRESH_INTERVAL)
+async def refresh_roster():
+    for gate in gates:
+        roster = rosters[gate.course]
+        try:
+            # `requests` is blocking, so keep it off the event loop
+            delta = await asyncio.to_thread(roster.sync)
+        except Exception as e:
+            print(f"Error refreshing {gate.course} roster, keeping the previous {len(roster.emails)} emails: {e}")
+            continue
+        ROSTER_EMAILS.set(len(roster.emails), course=gate.course)
+        if not delta.not_modified:
+            print(
+                f"Loaded {len(roster.emails)} authorized emails for {gate.course} from Maven endpoint "
+                f"({len(delta.added)} added, {len(delta.removed)} removed)"
             )
-        ''')
+        try:
+            if gate.course in rosters_to_match_in_full:
+                # Catch anyone who submitted while the bot was down, whatever the snapshot said
+                await verify_pending_from_roster(gate, roster.emails)
+                rosters_to_match_in_full.discard(gate.course)
+            elif delta.added:
+                # Otherwise pending students can only have become verified if their email was just added
+                await verify_pending_from_roster(gate, delta.added)
+        except Exception as e:
+            # The roster has already moved on (and the next sync may well be a 304), so match against all of
+            # it next time rather than lose the additions. Raising here would also stop the loop for good.
+            rosters_to_match_in_full.add(gate.course)
+            print(f"Error verifying pending {gate.course} students from the roster, retrying next refresh: {e}")
+
+@refresh_roster.before_loop
+async def before_refresh_roster():
+    await bot.wait_until_ready()
+
+async def lookup_student(user_id, course):
+    """
+    Returns the cached StudentStatus for `user_id` in `course`, hitting the database only for users we don't
+    know about yet. Pending students are re-read since `verify_students.py` flips them to verified out of process.
+    """
+    entry = status_cache.get((user_id, course))
+    if entry is not None and entry.status == STATUS_VERIFIED:
+        return entry
+    with SQLITE_QUERY_SECONDS.time(query='lookup_student'):
+        async with db.execute(SELECT_STUDENT_SQL, (user_id, course)) as cursor:
+            result = await cursor.fetchone()
+    if result:
+        email, verified = result
+        return record_student(user_id, course, verified, email)
+    return entry
+
+async def resolve_user(payload):
+    """Avoids a REST round trip when the reacting user is already in the gateway cache"""
+    if payload.member is not None:
+        return payload.member
+    user = bot.get_user(payload.user_id)
+    if user is None:
+        user = await bot.fetch_user(payload.user_id)
+    return user
+
+async def send_welcome(user, gate, priority=PRIORITY_WELCOME, on_sent=None):
+    """Asks `user` for the email they signed up for `gate`'s course with, and waits for their reply"""
+    await pending_verifications.add(db, user.id, gate.course)
+    
+    async def on_forbidden():
+        print(f"Cannot send DM to user {user.name}")
+        await pending_verifications.discard(db, user.id)
+    
+    await dm_queue.send(
+        user,
+        "Welcome! To verify your enrollment in the course, please reply with "
+        "the email address you used to sign up for the course.\n\n"
+        "Example: your.email@example.com",
+        priority=priority,
+        on_forbidden=on_forbidden,
+        on_sent=on_sent
+    )
+
+# Started from `on_ready`, and again after a reconnect that needed a new session
+backfill_task = None
+backfill_bucket = TokenBucket(BACKFILL_RATE, 1)
+
+async def save_backfill_checkpoint(gate, after_user_id):
+    with SQLITE_QUERY_SECONDS.time(query='save_backfill_checkpoint'):
+        await db.execute(
+            "INSERT OR REPLACE INTO reaction_checkpoints (course, message_id, after_user_id, updated_at) "
+            "VALUES (?, ?, ?, ?)",
+            (gate.course, gate.message_id, after_user_id, time.time())
+        )
         await db.commit()
 
+async def backfill_page(gate, users):
+    """Welcomes the reactors in `users` who haven't been handled yet. Returns how many were welcomed."""
+    users = [user for user in users if not user.bot]
+    if not users:
+        return 0
+    user_ids = [user.id for user in users]
+    placeholders = ','.join('?' * len(user_ids))
+    with SQLITE_QUERY_SECONDS.time(query='backfill_handled'):
+        async with db.execute(
+            f"SELECT user_id FROM student_emails WHERE course = ? AND user_id IN ({placeholders}) "
+            f"UNION SELECT user_id FROM welcomed_reactions WHERE course = ? AND user_id IN ({placeholders})",
+            (gate.course, *user_ids, gate.course, *user_ids)
+        ) as cursor:
+            handled = {user_id async for user_id, in cursor}
+    welcomed = 0
+    for user in users:
+        if user.id in handled or pending_verifications.course_for(user.id) == gate.course:
+            continue
+        # Also drops a live reaction from them that comes in while they're being welcomed here
+        if status_cache.in_cooldown((user.id, gate.course)):
+            continue
+        await backfill_bucket.acquire()
+        REACTIONS.inc(course=gate.course, outcome='backfill')
+        await send_welcome(user, gate, priority=PRIORITY_BACKFILL)
+        welcomed += 1
+    return welcomed
+
+async def backfill_gate(gate, message):
+    """Pages through the reactors of `gate`'s emoji on `message`, resuming from the saved checkpoint"""
+    reaction = discord.utils.find(lambda reaction: str(reaction.emoji) == gate.emoji, message.reactions)
+    if reaction is None:
+        return
+    async with db.execute(
+        "SELECT message_id, after_user_id FROM reaction_checkpoints WHERE course = ?", (gate.course,)
+    ) as cursor:
+        checkpoint = await cursor.fetchone()
+    start = checkpoint[1] if checkpoint and checkpoint[0] == gate.message_id else 0
+    # Reactors are fetched in user ID order, not in the order they reacted, so a scan resumed from the
+    # checkpoint wraps round to the IDs before it. Saving the cursor after every page keeps that true.
+    passes = [(start, None), (0, start)] if start else [(0, None)]
+    scanned = welcomed = 0
+    for after, until in passes:
+        users = reaction.users(limit=None, after=discord.Object(after) if after else None)
+        done = False
+        while not done:
+            # discord.py fetches pages of 100 in ascending ID order but yields each one in reverse, so don't
+            # rely on the order within a page
+            page = []
+            async for user in users:
+                page.append(user)
+                if len(page) == BACKFILL_PAGE_SIZE:
+                    break
+            else:
+                done = True
+            if not page:
+                break
+            highest = max(user.id for user in page)
+            if until is not None:
+                page = [user for user in page if user.id <= until]
+                done = done or highest >= until
+            welcomed += await backfill_page(gate, page)
+            scanned += len(page)
+            await save_backfill_checkpoint(gate, highest)
+    await save_backfill_checkpoint(gate, 0)
+    print(f"Reaction backfill for {gate.course}: {scanned} reactors checked, {welcomed} welcomed")
+
+async def backfill_reactions(messages):
+    for gate, message in messages:
+        try:
+            await backfill_gate(gate, message)
+        except discord.HTTPException as e:
+            print(f"Reaction backfill for {gate.course} failed, will resume from its checkpoint next time: {e}")
+
 def is_valid_email(email):
     pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
     return re.match(pattern, email) is not None
 
+async def store_submission(user, gate, email, source):
+    """
+    Records a valid `email` from `user` for `gate`'s course, verified straight away if it's on the roster, and
+    ends their pending verification for the course. Returns (STATUS_VERIFIED or STATUS_PENDING, email), or
+    (None, the email on file) if they already submitted one.
+    """
+    student = status_cache.get((user.id, gate.course))
+    if student is not None and student.status is not None:
+        if pending_verifications.course_for(user.id) == gate.course:
+            await pending_verifications.discard(db, user.id)
+    else:
+        normalized = normalize_email(email)
+        inserted, verified = await submission_writer.submit(
+            user, gate.course, email, normalized, normalized in rosters[gate.course].emails
+        )
+        pending_verifications.forget(user.id, gate.course)
+        if inserted:
+            record_student(user.id, gate.course, verified, email)
+            status = STATUS_VERIFIED if verified else STATUS_PENDING
+            SUBMISSIONS.inc(course=gate.course, source=source, outcome=status)
+            return status, email
+        student = await lookup_student(user.id, gate.course)
+    SUBMISSIONS.inc(course=gate.course, source=source, outcome='duplicate')
+    return None, student.email
+
+class EmailModal(discord.ui.Modal):
+    """The form the Verify button opens. Everything is answered in one ephemeral response, no DMs needed."""
+    email = discord.ui.TextInput(label='Email', placeholder='your.email@example.com', max_length=254)
+
+    def __init__(self, gate):
+        super().__init__(title='Verify your enrollment', custom_id=f'verify-email:{gate.course}')
+        self.gate = gate
+
+    async def on_submit(self, interaction):
+        received_at = time.perf_counter()
+        gate = self.gate
+        email = self.email.value.strip()
+        if not is_valid_email(email):
+            SUBMISSIONS.inc(course=gate.course, source='modal', outcome='invalid')
+            await interaction.response.send_message(
+                "That doesn't look like a valid email address. Please click Verify again and enter a valid "
+                "email address (e.g., your.email@example.com)",
+                ephemeral=True
+            )
+            return
+        
+        status, stored_email = await store_submission(interaction.user, gate, email, source='modal')
+        if status is None:
+            reply = (
+                f"You've already submitted an email: {stored_email}. "
+                "If you need to update it, please contact an administrator."
+            )
+        elif status == STATUS_PENDING:
+            DM_TO_INSERT_SECONDS.observe(time.perf_counter() - received_at, source='modal')
+            reply = (
+                f"Thank you! Your email ({email}) has been recorded and is pending verification. "
+                "You'll receive access to the course materials once verified."
+            )
+        else:
+            DM_TO_INSERT_SECONDS.observe(time.perf_counter() - received_at, source='modal')
+            reply = (
+                f"Thank you! Your email ({email}) has been verified. "
+                "You'll have access to the course materials in a moment."
+            )
+        # Reply before touching roles, which can be rate limited past the 3 seconds Discord gives us to respond
+        await interaction.response.send_message(reply, ephemeral=True)
+        
+        if status == STATUS_VERIFIED:
+            inserted_at = time.perf_counter()
+            member = interaction.user if isinstance(interaction.user, discord.Member) else None
+            if await assign_verified_role(interaction.user.id, gate, member=member):
+                INSERT_TO_ROLE_SECONDS.observe(time.perf_counter() - inserted_at)
+            else:
+                print(f"Verified {email} from the Verify button, but couldn't give {interaction.user} the role")
+
+class VerifyButtonView(discord.ui.View):
+    """
+    The persistent Verify button for a gate. Its custom_id is fixed per course, so after `add_view` in
+    `setup_hook` clicks on messages posted before a restart still reach it.
+    """
+    def __init__(self, gate):
+        super().__init__(timeout=None)
+        self.gate = gate
+        button = discord.ui.Button(
+            label='Verify', style=discord.ButtonStyle.success, custom_id=f'verify:{gate.course}'
+        )
+        button.callback = self.open_form
+        self.add_item(button)
+
+    async def open_form(self, interaction):
+        gate = self.gate
+        student = await lookup_student(interaction.user.id, gate.course)
+        if student is None or student.status is None:
+            REACTIONS.inc(course=gate.course, outcome='button')
+            await interaction.response.send_modal(EmailModal(gate))
+            return
+        
+        REACTIONS.inc(course=gate.course, outcome=student.status)
+        if student.status == STATUS_PENDING:
+            await interaction.response.send_message(
+                f"You've already submitted email: {student.email}. "
+                "It's pending verification. Please wait for approval.",
+                ephemeral=True
+            )
+            return
+        await interaction.response.send_message(
+            f"You've already been verified with email: {student.email}. "
+            "You should have access to the course materials.",
+            ephemeral=True
+        )
+        member = interaction.user if isinstance(interaction.user, discord.Member) else None
+        if member is not None and discord.utils.get(member.roles, name=gate.role_name) is None:
+            await assign_verified_role(member.id, gate, member=member)
+
+@bot.command(name='verifybutton')
+@commands.guild_only()
+@commands.has_permissions(manage_roles=True)
+async def post_verify_button(ctx, course=None):
+    """Posts a message with the Verify button for `course`, or for the gate in this channel"""
+    if course is not None:
+        gate = gates_by_course.get(course)
+    else:
+        gate = next((gate for gate in gates if gate.channel_id == ctx.channel.id), None)
+    if gate is None:
+        await ctx.send(f"No course {course!r}" if course else "No course uses this channel, use `!verifybutton COURSE`")
+        return
+    await ctx.send(
+        "Click Verify and enter the email address you used to sign up for the course to get access.",
+        view=VerifyButtonView(gate)
+    )
+
 @bot.event
 async def on_ready():
+    global backfill_task
     print(f'{bot.user} has connected to Discord!')
-    await init_db()
     
-    channel = bot.get_channel(CHANNEL_ID)
-    if channel:
-        try:
-            message = await channel.fetch_message(MESSAGE_ID)
-            print(f"Monitoring message: {MESSAGE_ID} in channel: {CHANNEL_ID}")
-        except discord.NotFound:
-            print(f"Message {MESSAGE_ID} not found in channel {CHANNEL_ID}")
-        except discord.Forbidden:
-            print(f"Bot doesn't have permission to access channel {CHANNEL_ID}")
-    else:
-        print(f"Channel {CHANNEL_ID} not found")
+    messages = []
+    for gate in gates:
+        channel = bot.get_channel(gate.channel_id)
+        if channel:
+            try:
+                message = await channel.fetch_message(gate.message_id)
+                messages.append((gate, message))
+                print(f"Monitoring message: {gate.message_id} in channel: {gate.channel_id} for {gate.course}")
+            except discord.NotFound:
+                print(f"Message {gate.message_id} not found in channel {gate.channel_id}")
+            except discord.Forbidden:
+                print(f"Bot doesn't have permission to access channel {gate.channel_id}")
+        else:
+            print(f"Channel {gate.channel_id} not found")
+    
+    if REACTION_BACKFILL and (backfill_task is None or backfill_task.done()):
+        backfill_task = asyncio.create_task(backfill_reactions(messages))
 
 @bot.event
 async def on_raw_reaction_add(payload):
-    if payload.message_id != MESSAGE_ID:
+    gate = gates_by_reaction.get((payload.message_id, payload.emoji.name))
+    if gate is None:
         return
     
-    if payload.emoji.name != '➕':
+    if payload.user_id == bot.user.id:
         return
     
-    if payload.user_id == bot.user.id:
+    if status_cache.in_cooldown((payload.user_id, gate.course)):
+        REACTIONS.inc(course=gate.course, outcome='cooldown')
         return
     
-    user = await bot.fetch_user(payload.user_id)
+    reacted_at = time.perf_counter()
     
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        cursor = await db.execute(
-            "SELECT email, verified FROM student_emails WHERE user_id = ?",
-            (user.id,)
-        )
-        result = await cursor.fetchone()
-        
-        if result:
-            email, verified = result
-            if verified:
-                await user.send(
-                    f"You've already been verified with email: {email}. "
-                    "You should have access to the course materials."
-                )
-            else:
-                await user.send(
-                    f"You've already submitted email: {email}. "
-                    "It's pending verification. Please wait for approval."
-                )
-            return
+    student = await lookup_student(payload.user_id, gate.course)
+    user = await resolve_user(payload)
     
-    pending_verifications[user.id] = True
+    if student is not None and student.status is not None:
+        REACTIONS.inc(course=gate.course, outcome=student.status)
+        if student.status == STATUS_VERIFIED:
+            member = payload.member
+            if member is not None and discord.utils.get(member.roles, name=gate.role_name) is None:
+                # They left and rejoined without `on_member_join` noticing (RESTORE_ON_JOIN isn't set)
+                await assign_verified_role(payload.user_id, gate, member=member)
+            await dm_queue.send(
+                user,
+                f"You've already been verified with email: {student.email}. "
+                "You should have access to the course materials."
+            )
+        else:
+            await dm_queue.send(
+                user,
+                f"You've already submitted email: {student.email}. "
+                "It's pending verification. Please wait for approval."
+            )
+        return
     
-    try:
-        await user.send(
-            "Welcome! To verify your enrollment in the course, please reply with "
-            "the email address you used to sign up for the course.\n\n"
-            "Example: your.email@example.com"
-        )
-    except discord.Forbidden:
-        print(f"Cannot send DM to user {user.name}")
-        pending_verifications.pop(user.id, None)
+    REACTIONS.inc(course=gate.course, outcome='welcome')
+    await send_welcome(
+        user, gate, on_sent=lambda: REACTION_TO_WELCOME_SECONDS.observe(time.perf_counter() - reacted_at)
+    )
+
+@bot.event
+async def on_member_join(member):
+    if member.bot:
+        return
+    for gate in gates:
+        if (member.id, gate.course) not in verified_students:
+            # They may have been verified by `verify_students.py` since we last looked
+            student = await lookup_student(member.id, gate.course)
+            if student is None or student.status != STATUS_VERIFIED:
+                continue
+        if await assign_verified_role(member.id, gate, member=member):
+            print(f"✓ Restored {gate.role_name} role for {member}")
 
 @bot.event
 async def on_message(message):
     if message.author.bot:
         return
     
+    # Only DMs are needed (and with GATEWAY_PROFILE=low_memory, guild messages aren't received at all)
+    if message.guild is not None:
+        await bot.process_commands(message)
+        return
+    
     if isinstance(message.channel, discord.DMChannel):
-        if message.author.id in pending_verifications:
+        gate = gates_by_course.get(pending_verifications.course_for(message.author.id))
+        if gate is not None:
+            received_at = time.perf_counter()
             email = message.content.strip()
             
             if not is_valid_email(email):
-                await message.channel.send(
+                SUBMISSIONS.inc(course=gate.course, source='dm', outcome='invalid')
+                await dm_queue.send(
+                    message.channel,
                     "That doesn't look like a valid email address. "
-                    "Please send a valid email address (e.g., your.email@example.com)"
+                    "Please send a valid email address (e.g., your.email@example.com)",
+                    priority=PRIORITY_REPLY
                 )
                 return
             
-            async with aiosqlite.connect(DATABASE_PATH) as db:
-                cursor = await db.execute(
-                    "SELECT email FROM student_emails WHERE user_id = ?",
-                    (message.author.id,)
+            status, stored_email = await store_submission(message.author, gate, email, source='dm')
+            
+            if status is None:
+                await dm_queue.send(
+                    message.channel,
+                    f"You've already submitted an email: {stored_email}. "
+                    "If you need to update it, please contact an administrator.",
+                    priority=PRIORITY_REPLY
                 )
-                existing = await cursor.fetchone()
-                
-                if existing:
-                    await message.channel.send(
-                        f"You've already submitted an email: {existing[0]}. "
-                        "If you need to update it, please contact an administrator."
-                    )
-                else:
-                    await db.execute(
-                        "INSERT INTO student_emails (user_id, username, email, submitted_at, verified) "
-                        "VALUES (?, ?, ?, ?, ?)",
-                        (
-                            message.author.id,
-                            str(message.author),
-                            email,
-                            datetime.now().isoformat(),
-                            False
-                        )
-                    )
-                    await db.commit()
-                    
-                    await message.channel.send(
+            else:
+                inserted_at = time.perf_counter()
+                DM_TO_INSERT_SECONDS.observe(inserted_at - received_at, source='dm')
+                if status == STATUS_PENDING:
+                    reply = (
                         f"Thank you! Your email ({email}) has been recorded and is pending verification. "
                         "You'll receive access to the course materials once verified."
                     )
-                
-                pending_verifications.pop(message.author.id, None)
+                elif await assign_verified_role(message.author.id, gate):
+                    INSERT_TO_ROLE_SECONDS.observe(time.perf_counter() - inserted_at)
+                    reply = (
+                        f"Thank you! Your email ({email}) has been verified. "
+                        "You now have access to the course materials."
+                    )
+                else:
+                    reply = (
+                        f"Thank you! Your email ({email}) has been verified, but I couldn't give you access "
+                        "automatically. An administrator will grant it shortly."
+                    )
+                await dm_queue.send(message.channel, reply, priority=PRIORITY_REPLY)
     
     await bot.process_commands(message)
 
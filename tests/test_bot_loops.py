@@ -0,0 +1,62 @@
+"""
+Tests that the bot's background loops in `student_verification_bot.py` survive a failed iteration, since
+`tasks.loop` stops for good on an exception it doesn't know about.
+"""
+
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+
+DATA_DIR = tempfile.mkdtemp()
+os.environ.update({
+    'DATABASE_PATH': os.path.join(DATA_DIR, 'students.db'),
+    'DISCORD_TOKEN': 'test',
+    'CHANNEL_ID': '1',
+    'MESSAGE_ID': '2',
+    'GATES_PATH': '',
+    'ROSTER_SNAPSHOT_PATH': os.path.join(DATA_DIR, 'maven_roster.json'),
+    'BACKFILL_RATE': '1000000',
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import student_verification_bot as bot_module
+from roster import RosterDelta
+
+class FakeRoster:
+    def __init__(self):
+        self.emails = set()
+        self.added = set()
+
+    def sync(self):
+        added, self.added = self.added, set()
+        self.emails |= added
+        return RosterDelta(added, set(), not added)
+
+def test_roster_additions_are_retried_after_a_failed_match(monkeypatch):
+    gate = bot_module.gates[0]
+    roster = FakeRoster()
+    monkeypatch.setitem(bot_module.rosters, gate.course, roster)
+    monkeypatch.setattr(bot_module, 'rosters_to_match_in_full', set())
+    matched = []
+    async def verify_pending_from_roster(gate, emails):
+        if not matched:
+            matched.append(None)
+            raise sqlite3.OperationalError('database is locked')
+        matched.append(set(emails))
+    monkeypatch.setattr(bot_module, 'verify_pending_from_roster', verify_pending_from_roster)
+
+    roster.added = {'a@example.edu'}
+    asyncio.run(bot_module.refresh_roster.coro())
+    # The next sync is a 304, but the addition it missed is still matched
+    asyncio.run(bot_module.refresh_roster.coro())
+    assert matched == [None, {'a@example.edu'}]
+    assert bot_module.rosters_to_match_in_full == set()
+
+def test_failed_sweep_is_logged_rather_than_raised(monkeypatch, capsys):
+    async def sweep(db):
+        raise sqlite3.OperationalError('database is locked')
+    monkeypatch.setattr(bot_module.pending_verifications, 'sweep', sweep)
+    asyncio.run(bot_module.sweep_pending_verifications.coro())
+    assert 'Error sweeping pending verifications: database is locked' in capsys.readouterr().out
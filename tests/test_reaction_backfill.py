@@ -0,0 +1,94 @@
+"""
+Tests for the startup reaction backfill in `student_verification_bot.py`, against a fake `Reaction.users`
+that pages like discord.py: 100 users at a time fetched in ascending ID order, each page yielded in reverse.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import types
+
+DATA_DIR = tempfile.mkdtemp()
+os.environ.update({
+    'DATABASE_PATH': os.path.join(DATA_DIR, 'students.db'),
+    'DISCORD_TOKEN': 'test',
+    'CHANNEL_ID': '1',
+    'MESSAGE_ID': '2',
+    'GATES_PATH': '',
+    'ROSTER_SNAPSHOT_PATH': os.path.join(DATA_DIR, 'maven_roster.json'),
+    'BACKFILL_RATE': '1000000',
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import student_verification_bot as bot_module
+from schema import migrate_async
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.name = f'user{user_id}'
+        self.bot = False
+
+class FakeReaction:
+    emoji = bot_module.gates[0].emoji
+
+    def __init__(self, user_ids):
+        self.user_ids = sorted(user_ids)
+        self.requests = []
+
+    async def users(self, limit=None, after=None):
+        after_id = after.id if after else 0
+        while True:
+            self.requests.append(after_id)
+            data = [user_id for user_id in self.user_ids if user_id > after_id][:100]
+            if not data:
+                return
+            after_id = data[-1]
+            for user_id in reversed(data):
+                yield FakeUser(user_id)
+
+async def run_backfill(reaction, welcomed=(), checkpoint=None):
+    """Backfills a fresh database and returns the user IDs welcomed and the saved checkpoint"""
+    if os.path.exists(bot_module.DATABASE_PATH):
+        os.remove(bot_module.DATABASE_PATH)
+    bot_module.pending_verifications.expires.clear()
+    bot_module.status_cache.entries.clear()
+    bot_module.dm_queue.queue = asyncio.PriorityQueue()
+    await bot_module.open_db()
+    try:
+        await migrate_async(bot_module.db)
+        gate = bot_module.gates[0]
+        await bot_module.db.executemany(
+            "INSERT INTO welcomed_reactions (user_id, course, welcomed_at) VALUES (?, ?, 0)",
+            [(user_id, gate.course) for user_id in welcomed]
+        )
+        if checkpoint is not None:
+            await bot_module.save_backfill_checkpoint(gate, checkpoint)
+        await bot_module.db.commit()
+        await bot_module.backfill_gate(gate, types.SimpleNamespace(reactions=[reaction]))
+        async with bot_module.db.execute("SELECT user_id FROM welcomed_reactions WHERE welcomed_at > 0") as cursor:
+            newly_welcomed = sorted([user_id async for user_id, in cursor])
+        async with bot_module.db.execute("SELECT after_user_id FROM reaction_checkpoints") as cursor:
+            saved_checkpoint = (await cursor.fetchone())[0]
+    finally:
+        await bot_module.close_db()
+    return newly_welcomed, saved_checkpoint
+
+def test_welcomes_every_reactor():
+    reaction = FakeReaction(range(1000, 1250))
+    welcomed, checkpoint = asyncio.run(run_backfill(reaction))
+    assert welcomed == list(range(1000, 1250))
+    assert checkpoint == 0
+    # One request per page, each after the highest ID of the previous one
+    assert reaction.requests == [0, 1099, 1199, 1249]
+
+def test_resumed_scan_wraps_round_to_reactors_before_the_checkpoint():
+    # The bot stopped after checkpointing 1150, and 1100-1150 reacted while it was down
+    missed = set(range(1100, 1151))
+    reaction = FakeReaction(range(1000, 1250))
+    welcomed, checkpoint = asyncio.run(run_backfill(
+        reaction, welcomed=[user_id for user_id in range(1000, 1250) if user_id not in missed], checkpoint=1150
+    ))
+    assert welcomed == sorted(missed)
+    assert checkpoint == 0
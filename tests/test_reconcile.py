@@ -0,0 +1,146 @@
+"""
+Tests for `--reconcile` in `verify_students.py`: the plan it diffs out of the database, the roster and the role
+holders, and the guards that keep `--apply` from revoking students against a bad roster.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+
+DATA_DIR = tempfile.mkdtemp()
+os.environ.update({
+    'DATABASE_PATH': os.path.join(DATA_DIR, 'reconcile.db'),
+    'DISCORD_TOKEN': 'test',
+    'GATES_PATH': '',
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import verify_students
+from roster import RosterDelta
+
+ROSTER = {'on@example.edu', 'shared@example.edu', 'new@example.edu'}
+
+def new_database(students):
+    """A fresh database with `students`, each (user_id, email, submitted_ts, verified)"""
+    if os.path.exists(verify_students.DATABASE_PATH):
+        os.remove(verify_students.DATABASE_PATH)
+    conn = verify_students.connect_db()
+    conn.executemany(
+        "INSERT INTO student_emails "
+        "(user_id, course, username, email, email_normalized, submitted_at, submitted_ts, verified) "
+        "VALUES (?, ?, ?, ?, ?, '2026-01-01T00:00:00', ?, ?)",
+        [
+            (user_id, verify_students.COURSE, f'user{user_id}', email, email, submitted_ts, verified)
+            for user_id, email, submitted_ts, verified in students
+        ]
+    )
+    conn.commit()
+    return conn
+
+def verified_ids(conn):
+    return {user_id for user_id, in conn.execute("SELECT user_id FROM student_emails WHERE verified")}
+
+def ids(rows):
+    return sorted(user_id for user_id, _, _ in rows)
+
+def test_plan():
+    conn = new_database([
+        (1, 'on@example.edu', 100, True),        # verified with the role: unchanged
+        (2, 'off@example.edu', 100, False),      # pending, not on the roster: unchanged
+        (3, 'off@example.edu', 101, True),       # verified by hand with the role, not on the roster
+        (4, 'new@example.edu', 100, False),      # only just added to the roster
+        (5, 'shared@example.edu', 100, True),    # claimed the email first: unchanged
+        (6, 'shared@example.edu', 200, False),   # same email, second account
+    ])
+    plan = verify_students.plan_reconcile(conn, ROSTER, role_holders={1, 3, 5, 6, 99})
+    conn.close()
+    assert plan.unchanged == 3
+    assert ids(plan.mark_verified) == [4]
+    assert ids(plan.add_roles) == [4]
+    assert ids(plan.mark_unverified) == [3]
+    # The second account on a claimed email loses the role it was given by hand, but is never verified
+    assert ids(plan.remove_roles) == [3, 6]
+    # 99 has the role without a row (e.g. staff), and is left alone
+    assert plan.unknown_role_holders == 1
+
+def test_plan_against_a_matching_roster_is_empty():
+    conn = new_database([(1, 'on@example.edu', 100, True), (2, 'off@example.edu', 100, False)])
+    plan = verify_students.plan_reconcile(conn, ROSTER, role_holders={1})
+    conn.close()
+    assert plan.is_empty()
+    assert plan.unchanged == 2
+
+class FakeRosterSync:
+    emails_to_load = set()
+    error = None
+
+    def __init__(self, maven_url, snapshot_path=None):
+        self.emails = set()
+
+    def sync(self):
+        if self.error is not None:
+            raise self.error
+        self.emails = set(self.emails_to_load)
+        return RosterDelta(self.emails, set(), False)
+
+@pytest.fixture
+def discord(monkeypatch):
+    """Stands in for the Discord side of `reconcile_roles`, returning the (user_id, username) pairs it changed"""
+    changed = {'assigned': [], 'revoked': []}
+
+    async def assign_verified_roles(students, role_holders=None):
+        changed['assigned'].extend(students)
+        return verify_students.RoleAssignmentResult()
+
+    async def revoke_verified_roles(students, role_holders=None):
+        changed['revoked'].extend(students)
+        return verify_students.RoleAssignmentResult(remove=True)
+
+    monkeypatch.setattr(verify_students, 'discord_ready', lambda: True)
+    monkeypatch.setattr(verify_students, 'verified_role_holders', lambda: {1, 3})
+    monkeypatch.setattr(verify_students, 'assign_verified_roles', assign_verified_roles)
+    monkeypatch.setattr(verify_students, 'revoke_verified_roles', revoke_verified_roles)
+    monkeypatch.setattr(verify_students, 'RosterSync', FakeRosterSync)
+    return changed
+
+STUDENTS = [
+    (1, 'on@example.edu', 100, True),
+    (3, 'off@example.edu', 100, True),
+    (4, 'new@example.edu', 100, False),
+]
+
+@pytest.mark.parametrize('emails, error', [(set(), None), (ROSTER, OSError('connection refused'))])
+def test_nothing_changes_without_a_roster(discord, monkeypatch, capsys, emails, error):
+    monkeypatch.setattr(FakeRosterSync, 'emails_to_load', emails)
+    monkeypatch.setattr(FakeRosterSync, 'error', error)
+    conn = new_database(STUDENTS)
+    asyncio.run(verify_students.reconcile_roles(apply=True, max_removals=1000))
+    assert verified_ids(conn) == {1, 3}
+    conn.close()
+    assert discord == {'assigned': [], 'revoked': []}
+    assert f"Could not load the {verify_students.COURSE} roster, nothing was changed" in capsys.readouterr().out
+
+def test_refuses_more_removals_than_the_limit(discord, capsys):
+    conn = new_database(STUDENTS)
+    asyncio.run(verify_students.reconcile_roles(authorized_emails={'new@example.edu'}, apply=True, max_removals=1))
+    assert verified_ids(conn) == {1, 3}
+    conn.close()
+    assert discord == {'assigned': [], 'revoked': []}
+    assert "Refusing to revoke 2 students (the limit is 1)" in capsys.readouterr().out
+
+def test_applies_within_the_limit(discord):
+    conn = new_database(STUDENTS)
+    asyncio.run(verify_students.reconcile_roles(authorized_emails=ROSTER, apply=True, max_removals=1))
+    assert verified_ids(conn) == {1, 4}
+    conn.close()
+    assert discord == {'assigned': [(4, 'user4')], 'revoked': [(3, 'user3')]}
+
+def test_dry_run_changes_nothing(discord):
+    conn = new_database(STUDENTS)
+    asyncio.run(verify_students.reconcile_roles(authorized_emails=ROSTER))
+    assert verified_ids(conn) == {1, 3}
+    conn.close()
+    assert discord == {'assigned': [], 'revoked': []}
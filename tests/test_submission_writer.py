@@ -0,0 +1,82 @@
+"""
+Tests for `SubmissionWriter` in `student_verification_bot.py`: duplicate submissions and claimed emails, both
+against rows already in the database and within a single batch.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+
+DATA_DIR = tempfile.mkdtemp()
+os.environ.update({
+    'DATABASE_PATH': os.path.join(DATA_DIR, 'students.db'),
+    'DISCORD_TOKEN': 'test',
+    'CHANNEL_ID': '1',
+    'MESSAGE_ID': '2',
+    'GATES_PATH': '',
+    'ROSTER_SNAPSHOT_PATH': os.path.join(DATA_DIR, 'maven_roster.json'),
+    'BACKFILL_RATE': '1000000',
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import student_verification_bot as bot_module
+from schema import migrate_async
+
+COURSE = bot_module.gates[0].course
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+
+    def __str__(self):
+        return f'user{self.id}'
+
+async def write_batches(batches):
+    """
+    Submits each batch of (user_id, email, on_roster) at once, so it is written as one transaction, against a
+    fresh database. Returns the (inserted, verified) results and the rows as {user_id: (email, verified)}.
+    """
+    if os.path.exists(bot_module.DATABASE_PATH):
+        os.remove(bot_module.DATABASE_PATH)
+    await bot_module.open_db()
+    writer = bot_module.SubmissionWriter(max_batch=100, max_delay=0.05)
+    results = []
+    try:
+        await migrate_async(bot_module.db)
+        writer.start()
+        for batch in batches:
+            results.append(await asyncio.gather(*(
+                writer.submit(FakeUser(user_id), COURSE, email, email, on_roster)
+                for user_id, email, on_roster in batch
+            )))
+        await writer.stop()
+        async with bot_module.db.execute("SELECT user_id, email, verified FROM student_emails") as cursor:
+            rows = {user_id: (email, bool(verified)) async for user_id, email, verified in cursor}
+    finally:
+        await bot_module.close_db()
+    return results, rows
+
+def test_duplicate_submissions_in_one_batch_insert_one_row():
+    results, rows = asyncio.run(write_batches([
+        [(1, 'a@example.edu', True), (1, 'b@example.edu', False)],
+        [(1, 'c@example.edu', True)],
+    ]))
+    assert results == [[(True, True), (False, False)], [(False, True)]]
+    assert rows == {1: ('a@example.edu', True)}
+
+def test_claimed_email_in_one_batch_only_verifies_the_first_account():
+    results, rows = asyncio.run(write_batches([
+        [(1, 'a@example.edu', True), (2, 'a@example.edu', True), (3, 'b@example.edu', False)],
+    ]))
+    assert results == [[(True, True), (True, False), (True, False)]]
+    assert rows == {1: ('a@example.edu', True), 2: ('a@example.edu', False), 3: ('b@example.edu', False)}
+
+def test_email_claimed_by_an_earlier_submission_is_not_verified():
+    results, rows = asyncio.run(write_batches([
+        [(1, 'a@example.edu', False)],
+        # Pending accounts count as claims too, the roster only decides whether the first one is verified
+        [(2, 'a@example.edu', True)],
+    ]))
+    assert results == [[(True, False)], [(True, False)]]
+    assert rows == {1: ('a@example.edu', False), 2: ('a@example.edu', False)}
@@ -0,0 +1,89 @@
+"""
+Tests for `VerificationWatcher` in `verify_students.py` (`--watch`), against a fake roster and a second
+connection standing in for the bot holding the write lock.
+"""
+
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+
+DATA_DIR = tempfile.mkdtemp()
+os.environ.update({
+    'DATABASE_PATH': os.path.join(DATA_DIR, 'watch.db'),
+    'DISCORD_TOKEN': 'test',
+    'GATES_PATH': '',
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import verify_students
+from roster import RosterDelta
+
+class FakeRoster:
+    def __init__(self, emails):
+        self.emails = set(emails)
+        self.added = set()
+
+    def sync(self):
+        added, self.added = self.added, set()
+        self.emails |= added
+        return RosterDelta(added, set(), not added)
+
+def insert_student(conn, user_id, email, submitted_ts):
+    conn.execute(
+        "INSERT INTO student_emails "
+        "(user_id, course, username, email, email_normalized, submitted_at, submitted_ts, verified) "
+        "VALUES (?, ?, ?, ?, ?, '2026-01-01T00:00:00', ?, FALSE)",
+        (user_id, verify_students.COURSE, f'user{user_id}', email, email, submitted_ts)
+    )
+    conn.commit()
+
+def verified(conn, user_id):
+    return conn.execute("SELECT verified FROM student_emails WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+def run_ticks(watcher, ticks):
+    """Runs each tick in `ticks` (True for one made while another connection holds the write lock)"""
+    async def run():
+        for locked in ticks:
+            blocker = sqlite3.connect(verify_students.DATABASE_PATH, isolation_level=None)
+            if locked:
+                blocker.execute("BEGIN IMMEDIATE")
+            try:
+                await watcher.tick()
+            except sqlite3.OperationalError:
+                watcher.conn.rollback()
+            finally:
+                blocker.close()
+    asyncio.run(run())
+
+def new_watcher(roster):
+    if os.path.exists(verify_students.DATABASE_PATH):
+        os.remove(verify_students.DATABASE_PATH)
+    conn = verify_students.connect_db()
+    # Fail straight away rather than wait out the busy timeout
+    conn.execute("PRAGMA busy_timeout = 0")
+    return verify_students.VerificationWatcher(conn, roster)
+
+def test_submission_is_verified_after_a_failed_tick():
+    watcher = new_watcher(FakeRoster({'a@example.edu'}))
+    insert_student(watcher.conn, 1, 'a@example.edu', 100)
+    run_ticks(watcher, [True])
+    assert verified(watcher.conn, 1) == 0
+    assert watcher.watermark == 0
+    run_ticks(watcher, [False])
+    assert verified(watcher.conn, 1) == 1
+    assert watcher.last_tick['new_submissions'] == 1
+    watcher.conn.close()
+
+def test_roster_addition_is_matched_after_a_failed_tick():
+    roster = FakeRoster(set())
+    watcher = new_watcher(roster)
+    insert_student(watcher.conn, 1, 'a@example.edu', 100)
+    run_ticks(watcher, [False])
+    assert verified(watcher.conn, 1) == 0
+    # The roster sync that reports the addition happens in the tick that fails
+    roster.added = {'a@example.edu'}
+    run_ticks(watcher, [True, False])
+    assert verified(watcher.conn, 1) == 1
+    watcher.conn.close()
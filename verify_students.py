@@ -5,91 +5,363 @@ Make sure the following is set:
 Environment Variables:
 - `DATABASE_PATH`: Should be the same database path as with `student_verification_bot.py`
 - `DISCORD_TOKEN`: Should be the same token as the one with `student_verification_bot.py`
-- `maven_url`: Should be the maven URL that they provide to you for a link to all your students emails
-               and names for verification
+- `MAVEN_URL`: Should be the maven URL that they provide to you for a link to all your students emails
+               and names for verification (read by `roster.py`)
+- `ROLE_ASSIGN_CONCURRENCY`: (Optional) How many role assignments run at once. Defaults to 5
+- `GUILD_ID`: (Optional) The server to verify students in. Only used with `--rest`, where it saves looking it up
+- `WATCH_INTERVAL`: (Optional) Seconds between checks in `--watch` mode. Defaults to 60
+- `RECONCILE_MAX_REMOVALS`: (Optional) Most students `--reconcile --apply` may revoke in one run. Defaults to 25
+- `GATES_PATH`: (Optional) Same as with `student_verification_bot.py`, when running several courses
+- `METRICS_PATH`: (Optional) Where to write the JSON metrics summary (see `metrics.py`) when the script exits,
+                  instead of printing it. It has SQLite query times, role assignment latency, Discord 429s and
+                  roster download/parse times.
+
+`python verify_students.py --all` lists students a page at a time. It can also filter and export them for
+reporting, streaming rows from the database so memory use stays flat however many there are:
+    python verify_students.py --all --status pending --since 2025-01-01 --until 2025-01-31 \\
+        --domain example.com --format csv --output pending.csv
+`--status` is pending or verified, `--format` is table (the default), csv or jsonl, and without `--output` the
+export goes to stdout.
+
+With several courses (see `gates.py`), add `--course NAME` to any mode to pick which one to verify. Each course
+uses its own roster and role from the gate config, and defaults to "default".
+
+`python verify_students.py --watch` keeps running instead of being relaunched from cron. It keeps one Discord
+client and one database connection open and, every `WATCH_INTERVAL` seconds, only looks at emails submitted
+since the last check plus any emails newly added to the Maven roster.
+
+At startup the roster download, the database migration and the Discord login run at the same time, so a slow
+Maven endpoint doesn't hold up the gateway connection (or the other way round).
+
+`python verify_students.py --reconcile` makes the verified role match the roster in both directions. In one
+pass over the course's students it compares who has the role, who is verified in the database and who is on
+the roster, and prints exactly which roles would be added or removed and which database rows would change.
+Nothing is changed unless `--apply` is given, and then only the roles in that diff are touched (at
+`ROLE_ASSIGN_CONCURRENCY` requests at a time, waiting out rate limits), so a run costs one request per change
+rather than one per student. The roster is the source of truth: students verified by hand who aren't on it
+lose the role too, so check the dry run first. People with the role who never submitted an email (e.g. staff)
+are left alone. The bot caches who is verified, so restart it after applying removals.
+The roster is always downloaded fresh for `--reconcile`: if the download fails or the roster is empty (e.g.
+`MAVEN_URL` isn't set), nothing is planned or changed rather than reconciling against an old snapshot or an
+empty list. As a further guard `--apply` refuses to take the role away from more than `RECONCILE_MAX_REMOVALS`
+students (default 25) in one run; pass `--max-removals N` after checking the dry run to allow more.
+
+Add `--rest` to any mode (e.g. `python verify_students.py --auto --rest`) to skip the gateway connection
+entirely. Instead of waiting for Discord to send the whole member list, only the students being processed
+are fetched over HTTP, so startup time depends on how many students there are rather than on the server size.
 """
 
 import sqlite3
 import os
+import csv
+import json
+import contextlib
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timedelta
 import sys
 import discord
 import asyncio
-import csv
-import requests
-import io
+import time
+from roster import RosterSync, load_authorized_emails
+from dm_queue import retry_after_from
+from schema import CLAIMED_BY_ANOTHER_ACCOUNT_SQL, migrate
+from gates import DEFAULT_COURSE, Gate, load_gates
+import metrics
 
 load_dotenv()
 
 DATABASE_PATH = os.getenv('DATABASE_PATH')
 DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
+ROLE_ASSIGN_CONCURRENCY = int(os.getenv('ROLE_ASSIGN_CONCURRENCY', '5'))
+GUILD_ID = os.getenv('GUILD_ID')
+WATCH_INTERVAL = float(os.getenv('WATCH_INTERVAL', '60'))
+RECONCILE_MAX_REMOVALS = int(os.getenv('RECONCILE_MAX_REMOVALS', '25'))
+LISTING_PAGE_SIZE = 50
+METRICS_PATH = os.getenv('METRICS_PATH')
+
+SQLITE_QUERY_SECONDS = metrics.histogram('sqlite_query_seconds', 'SQLite query time (including commit), by query')
+ROLE_ASSIGN_SECONDS = metrics.histogram(
+    'role_assign_seconds', 'Time to give a student the verified role (or take it away), by request and result'
+)
+MEMBER_FETCH_SECONDS = metrics.histogram('member_fetch_seconds', 'Time to fetch a member over HTTP in --rest mode')
+RATE_LIMITED = metrics.counter('discord_rate_limited_total', 'Discord requests that got a 429, by request')
+RETRY_AFTER_SECONDS = metrics.counter(
+    'discord_retry_after_seconds_total', 'Seconds Discord asked us to back off for, by request'
+)
+STARTUP_SECONDS = metrics.histogram('startup_seconds', 'Time for each startup step (they run concurrently), by step')
+STUDENTS_VERIFIED = metrics.counter('students_verified_total', 'Students marked as verified in the database')
+
+REST_ONLY = '--rest' in sys.argv
+
+# Options that take a value, e.g. `--course NAME`. Any of them can be combined with a mode.
+FLAG_OPTIONS = ('--rest', '--apply')
+VALUE_OPTIONS = (
+    '--course', '--status', '--since', '--until', '--domain', '--format', '--output', '--page-size', '--max-removals'
+)
+
+def option_from_argv(name, default=None):
+    if name in sys.argv:
+        index = sys.argv.index(name)
+        if index + 1 < len(sys.argv):
+            return sys.argv[index + 1]
+    return default
+
+COURSE = option_from_argv('--course', DEFAULT_COURSE)
+# Without a gate config (e.g. CHANNEL_ID isn't set for the verifier) the course still gets the default role and roster
+GATE = next((gate for gate in load_gates() if gate.course == COURSE), None) or Gate(COURSE, None, None)
+VERIFIED_ROLE_NAME = GATE.role_name
+
+# Populated by `connect_rest` when running with `--rest`
+rest_guild_roles = []
+fetched_members = {}
 
 intents = discord.Intents.default()
 intents.guilds = True
 intents.members = True
 client = discord.Client(intents=intents)
 
-def load_authorized_emails():
-    """Load the list of authorized emails from Maven endpoint"""
-    authorized_emails = set()
-    maven_url = "INSERT_MAVEN_URL_THEY_GIVE_YOU_HERE"
-    
-    try:
-        print("Downloading authorized emails from Maven endpoint...")
-        response = requests.get(maven_url, timeout=30)
-        response.raise_for_status()
-        
-        # Parse CSV from response content
-        csv_content = io.StringIO(response.text)
-        reader = csv.DictReader(csv_content)
-        
-        for row in reader:
-            # The email column is named "Users → Email" in the CSV
-            email_column = 'Users â\x86\x92 Email'
-            if email_column in row and row[email_column]:
-                authorized_emails.add(row[email_column].strip().lower())
-            
-        print(f"Loaded {len(authorized_emails)} authorized emails from Maven endpoint")
-    except requests.exceptions.RequestException as e:
-        print(f"Error downloading CSV from Maven endpoint: {e}")
-    except Exception as e:
-        print(f"Error parsing CSV data: {e}")
-    
-    return authorized_emails
-
-async def assign_verified_role(user_id, username):
-    try:
-        for guild in client.guilds:
-            member = guild.get_member(user_id)
-            if member:
-                verified_role = discord.utils.get(guild.roles, name="verified")
-                print(f"Adding role to {member}")
-                
-                await member.add_roles(verified_role, reason="Student email verified")
-                return True
-        return False
-    except Exception as e:
-        print(f"Error assigning role: {e}")
-        return False
+def connect_db():
+    conn = sqlite3.connect(DATABASE_PATH)
+    with SQLITE_QUERY_SECONDS.time(query='migrate'):
+        migrate(conn)
+    return conn
+
+class RoleAssignmentResult:
+    def __init__(self, remove=False):
+        # With `remove`, `assigned` holds the members the role was taken from and `already_had` those without it
+        self.remove = remove
+        self.assigned = []
+        self.already_had = []
+        self.not_in_guild = []
+        self.failed = []
+
+    def print_summary(self):
+        verb = "remove Discord role from" if self.remove else "assign Discord role to"
+        for user_id, username in self.not_in_guild:
+            print(f"✗ Could not {verb}: {username} (user_id: {user_id}), not in server")
+        for user_id, username, error in self.failed:
+            print(f"✗ Could not {verb}: {username} (user_id: {user_id}): {error}")
+        print(
+            f"Roles: {len(self.assigned)} {'removed' if self.remove else 'assigned'}, "
+            f"{len(self.already_had)} {'already without it' if self.remove else 'already had it'}, "
+            f"{len(self.not_in_guild)} not in server, {len(self.failed)} failed"
+        )
+
+def discord_ready():
+    return bool(rest_guild_roles) if REST_ONLY else client.is_ready()
+
+async def connect_rest():
+    """Finds the guild(s) with the verified role over HTTP, without opening a gateway connection"""
+    if GUILD_ID:
+        guild_ids = [int(GUILD_ID)]
+    else:
+        guild_ids = [guild.id async for guild in client.fetch_guilds(limit=None)]
+    for guild_id in guild_ids:
+        # Unlike the partial guilds from `fetch_guilds`, this includes the roles
+        guild = await client.fetch_guild(guild_id)
+        verified_role = discord.utils.get(guild.roles, name=VERIFIED_ROLE_NAME)
+        if verified_role is not None:
+            rest_guild_roles.append((guild, verified_role))
+    if not rest_guild_roles:
+        print(f"No server with a '{VERIFIED_ROLE_NAME}' role found")
+
+async def fetch_members(user_ids, max_attempts=3):
+    """
+    Fetches only the given members over HTTP into `fetched_members`, `ROLE_ASSIGN_CONCURRENCY` at a time.
+    Discord has no REST endpoint to fetch several members by ID, so this is one request per student.
+    """
+    semaphore = asyncio.Semaphore(ROLE_ASSIGN_CONCURRENCY)
+
+    async def fetch(user_id):
+        async with semaphore:
+            for guild, _ in rest_guild_roles:
+                for _ in range(max_attempts):
+                    try:
+                        with MEMBER_FETCH_SECONDS.time():
+                            fetched_members[user_id] = await guild.fetch_member(user_id)
+                        return
+                    except discord.NotFound:
+                        break
+                    except discord.HTTPException as e:
+                        if e.status != 429:
+                            print(f"Error fetching member {user_id}: {e}")
+                            break
+                        retry_after = retry_after_from(e)
+                        RATE_LIMITED.inc(request='fetch_member')
+                        RETRY_AFTER_SECONDS.inc(retry_after, request='fetch_member')
+                        await asyncio.sleep(retry_after)
+
+    user_ids = [user_id for user_id in user_ids if user_id not in fetched_members]
+    await asyncio.gather(*(fetch(user_id) for user_id in user_ids))
+    print(f"Fetched {len(user_ids)} members over HTTP")
+
+def find_member(user_id, guild_roles):
+    """Returns the member and the verified role of their guild, or (None, None) if they aren't in one"""
+    if REST_ONLY:
+        member = fetched_members.get(user_id)
+        if member is not None:
+            for guild, verified_role in guild_roles:
+                if guild.id == member.guild.id:
+                    return member, verified_role
+        return None, None
+    for guild, verified_role in guild_roles:
+        member = guild.get_member(user_id)
+        if member is not None:
+            return member, verified_role
+    return None, None
+
+def resolve_verified_roles():
+    """Returns (guild, verified role) for every guild the client is in that has the role"""
+    if REST_ONLY:
+        return rest_guild_roles
+    guild_roles = []
+    for guild in client.guilds:
+        verified_role = discord.utils.get(guild.roles, name=VERIFIED_ROLE_NAME)
+        if verified_role is not None:
+            guild_roles.append((guild, verified_role))
+    return guild_roles
+
+def verified_role_holders(guild_roles=None):
+    """Set of user IDs that already hold the verified role, built once from `role.members`"""
+    if guild_roles is None:
+        guild_roles = resolve_verified_roles()
+    role_holders = set()
+    if REST_ONLY:
+        # Without the gateway's member cache `role.members` is empty, so use the members we fetched
+        verified_role_ids = {verified_role.id for _, verified_role in guild_roles}
+        for member in fetched_members.values():
+            if any(role.id in verified_role_ids for role in member.roles):
+                role_holders.add(member.id)
+        return role_holders
+    for _, verified_role in guild_roles:
+        role_holders.update(member.id for member in verified_role.members)
+    return role_holders
+
+async def change_verified_roles(students, remove=False, role_holders=None, max_attempts=3):
+    """
+    Gives the verified role to (or with `remove`, takes it from) each (user_id, username) in `students`,
+    running up to `ROLE_ASSIGN_CONCURRENCY` requests at once and sleeping out 429s. Members who already
+    hold the role (`role_holders`, built here if not passed in), or don't when removing, are skipped.
+    """
+    result = RoleAssignmentResult(remove)
+    guild_roles = resolve_verified_roles()
+    if role_holders is None:
+        role_holders = verified_role_holders(guild_roles)
+    semaphore = asyncio.Semaphore(ROLE_ASSIGN_CONCURRENCY)
+    request = 'remove_roles' if remove else 'add_roles'
+
+    async def change(user_id, username):
+        if (user_id in role_holders) != remove:
+            result.already_had.append((user_id, username))
+            return
+        member, verified_role = find_member(user_id, guild_roles)
+        if member is None:
+            result.not_in_guild.append((user_id, username))
+            return
+        async with semaphore:
+            start = time.perf_counter()
+            for _ in range(max_attempts):
+                try:
+                    if remove:
+                        await member.remove_roles(verified_role, reason="Student no longer on the Maven roster")
+                    else:
+                        await member.add_roles(verified_role, reason="Student email verified")
+                    result.assigned.append((user_id, username))
+                    ROLE_ASSIGN_SECONDS.observe(time.perf_counter() - start, result='changed', request=request)
+                    return
+                except discord.RateLimited as e:
+                    retry_after = e.retry_after
+                except discord.HTTPException as e:
+                    if e.status != 429:
+                        result.failed.append((user_id, username, str(e)))
+                        ROLE_ASSIGN_SECONDS.observe(time.perf_counter() - start, result='failed', request=request)
+                        return
+                    retry_after = retry_after_from(e)
+                RATE_LIMITED.inc(request=request)
+                RETRY_AFTER_SECONDS.inc(retry_after, request=request)
+                await asyncio.sleep(retry_after)
+            result.failed.append((user_id, username, "rate limited"))
+            ROLE_ASSIGN_SECONDS.observe(time.perf_counter() - start, result='rate_limited', request=request)
+
+    await asyncio.gather(*(change(user_id, username) for user_id, username in students))
+    return result
+
+async def assign_verified_roles(students, role_holders=None, max_attempts=3):
+    return await change_verified_roles(students, role_holders=role_holders, max_attempts=max_attempts)
+
+async def revoke_verified_roles(students, role_holders=None, max_attempts=3):
+    return await change_verified_roles(students, remove=True, role_holders=role_holders, max_attempts=max_attempts)
+
+def find_duplicate_emails(conn):
+    """(email, usernames) for every email submitted by more than one Discord account"""
+    with SQLITE_QUERY_SECONDS.time(query='find_duplicate_emails'):
+        return conn.execute("""
+            SELECT email_normalized, group_concat(username, ', ')
+            FROM student_emails
+            WHERE course = ?
+            GROUP BY email_normalized
+            HAVING COUNT(*) > 1
+        """, (COURSE,)).fetchall()
+
+def mark_verified(conn, user_ids):
+    """Marks each of `user_ids` as verified in `COURSE` with a single `executemany`"""
+    with SQLITE_QUERY_SECONDS.time(query='mark_verified'):
+        conn.executemany(
+            "UPDATE student_emails SET verified = TRUE WHERE user_id = ? AND course = ?",
+            [(user_id, COURSE) for user_id in user_ids]
+        )
+    STUDENTS_VERIFIED.inc(len(user_ids))
+
+def mark_authorized_verified(conn, authorized_emails):
+    """
+    Marks every unverified student whose email is in `authorized_emails` as verified with one set-based
+    UPDATE against a temp table of the roster, returning the (user_id, username, email) rows it changed.
+    Students whose email another account claimed first are left for an administrator.
+    """
+    with SQLITE_QUERY_SECONDS.time(query='mark_authorized_verified'):
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS authorized_emails (email TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM temp.authorized_emails")
+        conn.executemany(
+            "INSERT OR IGNORE INTO temp.authorized_emails (email) VALUES (?)",
+            [(email,) for email in authorized_emails]
+        )
+        rows = conn.execute(f"""
+            UPDATE student_emails SET verified = TRUE
+            WHERE course = ? AND verified = FALSE AND email_normalized IN (SELECT email FROM temp.authorized_emails)
+            AND NOT {CLAIMED_BY_ANOTHER_ACCOUNT_SQL}
+            RETURNING user_id, username, email
+        """, (COURSE,)).fetchall()
+    STUDENTS_VERIFIED.inc(len(rows))
+    return rows
+
+def mark_unverified(conn, user_ids):
+    """Marks each of `user_ids` as no longer verified in `COURSE` with a single `executemany`"""
+    with SQLITE_QUERY_SECONDS.time(query='mark_unverified'):
+        conn.executemany(
+            "UPDATE student_emails SET verified = FALSE WHERE user_id = ? AND course = ?",
+            [(user_id, COURSE) for user_id in user_ids]
+        )
 
 @client.event
 async def on_ready():
     print(f'Discord client connected as {client.user}')
 
-def display_pending_students():
-    conn = sqlite3.connect(DATABASE_PATH)
+def display_pending_students(authorized_emails=None):
+    conn = connect_db()
     cursor = conn.cursor()
     
-    # Load authorized emails from CSV
-    authorized_emails = load_authorized_emails()
+    # Load authorized emails from CSV, unless `main` already downloaded them during startup
+    if authorized_emails is None:
+        authorized_emails = load_authorized_emails(GATE.maven_url, GATE.snapshot_path)
     
     # Get ALL students from database
-    cursor.execute("""
-        SELECT user_id, username, email, submitted_at, verified 
+    cursor.execute(f"""
+        SELECT user_id, username, email, email_normalized, submitted_at, verified,
+            {CLAIMED_BY_ANOTHER_ACCOUNT_SQL} AS claimed
         FROM student_emails 
-        ORDER BY submitted_at
-    """)
+        WHERE course = ?
+        ORDER BY submitted_ts
+    """, (COURSE,))
     
     all_students = cursor.fetchall()
     
@@ -98,32 +370,24 @@ def display_pending_students():
         conn.close()
         return
     
+    duplicate_emails = find_duplicate_emails(conn)
+    
     # Separate students into categories
     pending_without_role = []
     verified_without_role = []
     already_have_role = []
     
-    for user_id, username, email, submitted_at, verified in all_students:
-        # Check if user has the verified role on Discord
-        has_role = False
-        if client.is_ready():
-            for guild in client.guilds:
-                member = guild.get_member(user_id)
-                if member:
-                    verified_role = discord.utils.get(guild.roles, name="verified")
-                    if verified_role and verified_role in member.roles:
-                        has_role = True
-                        break
-        
-        if has_role:
+    # Who already has the verified role on Discord
+    role_holders = verified_role_holders() if discord_ready() else set()
+    newly_verified = []
+    
+    for user_id, username, email, normalized, submitted_at, verified, claimed in all_students:
+        if user_id in role_holders:
             already_have_role.append((user_id, username, email, submitted_at, verified))
-        elif email.lower() in authorized_emails:
+        elif normalized in authorized_emails and (verified or not claimed):
             # Auto-verify if in authorized list and update database
             if not verified:
-                cursor.execute(
-                    "UPDATE student_emails SET verified = TRUE WHERE user_id = ?",
-                    (user_id,)
-                )
+                newly_verified.append(user_id)
                 print(f"✓ Auto-verified in database: {email} (from Maven endpoint)")
             verified_without_role.append((user_id, username, email, submitted_at))
         elif not verified:
@@ -132,6 +396,7 @@ def display_pending_students():
             # Verified in DB but not in CSV and no role
             verified_without_role.append((user_id, username, email, submitted_at))
     
+    mark_verified(conn, newly_verified)
     conn.commit()
     
     # Display summary
@@ -158,7 +423,7 @@ def display_pending_students():
     # Show pending students
     if pending_without_role:
         print("\n" + "="*80)
-        print("PENDING STUDENT VERIFICATIONS (NOT IN MAVEN LIST)")
+        print("PENDING STUDENT VERIFICATIONS (NOT IN MAVEN LIST OR EMAIL ALREADY CLAIMED)")
         print("="*80)
         print(f"{'#':<5} {'User ID':<20} {'Username':<25} {'Email':<30} {'Submitted':<20}")
         print("-"*80)
@@ -167,6 +432,13 @@ def display_pending_students():
             submitted_date = datetime.fromisoformat(submitted_at).strftime("%Y-%m-%d %H:%M")
             print(f"{idx:<5} {user_id:<20} {username:<25} {email:<30} {submitted_date:<20}")
     
+    if duplicate_emails:
+        print("\n" + "="*80)
+        print("EMAILS CLAIMED BY MORE THAN ONE DISCORD ACCOUNT")
+        print("="*80)
+        for email, usernames in duplicate_emails:
+            print(f"{email:<40} {usernames}")
+    
     print("\n" + "="*80)
     
     # Return both lists for processing
@@ -174,14 +446,12 @@ def display_pending_students():
 
 async def verify_students(conn, verified_without_role, pending_students):
     # First, automatically assign roles to verified users who don't have them
-    if verified_without_role and client.is_ready():
+    if verified_without_role and discord_ready():
         print("\nAutomatically assigning roles to verified students...")
-        for user_id, username, email, _ in verified_without_role:
-            success = await assign_verified_role(user_id, username)
-            if success:
-                print(f"✓ Discord role assigned to: {username}")
-            else:
-                print(f"✗ Could not assign Discord role to: {username} (user_id: {user_id})")
+        result = await assign_verified_roles(
+            [(user_id, username) for user_id, username, _, _ in verified_without_role]
+        )
+        result.print_summary()
     
     # If no pending students, we're done
     if not pending_students:
@@ -196,15 +466,10 @@ async def verify_students(conn, verified_without_role, pending_students):
         conn.close()
         return
     
-    cursor = conn.cursor()
     verified_users = []
     
     if user_input.lower() == 'all':
         for user_id, username, email, _ in pending_students:
-            cursor.execute(
-                "UPDATE student_emails SET verified = TRUE WHERE user_id = ?",
-                (user_id,)
-            )
             verified_users.append((user_id, username, email))
             print(f"✓ Database updated for: {email}")
     else:
@@ -213,10 +478,6 @@ async def verify_students(conn, verified_without_role, pending_students):
             for idx in indices:
                 if 0 <= idx < len(pending_students):
                     user_id, username, email, _ = pending_students[idx]
-                    cursor.execute(
-                        "UPDATE student_emails SET verified = TRUE WHERE user_id = ?",
-                        (user_id,)
-                    )
                     verified_users.append((user_id, username, email))
                     print(f"✓ Database updated for: {email}")
                 else:
@@ -226,96 +487,174 @@ async def verify_students(conn, verified_without_role, pending_students):
             conn.close()
             return
     
+    mark_verified(conn, [user_id for user_id, _, _ in verified_users])
     conn.commit()
     conn.close()
     
-    if verified_users and client.is_ready():
+    if verified_users and discord_ready():
         print("\nAssigning Discord roles to newly verified students...")
-        for user_id, username, email in verified_users:
-            success = await assign_verified_role(user_id, username)
-            if success:
-                print(f"✓ Discord role assigned to: {username}")
-            else:
-                print(f"✗ Could not assign Discord role to: {username} (user_id: {user_id})")
+        result = await assign_verified_roles([(user_id, username) for user_id, username, _ in verified_users])
+        result.print_summary()
     
     print("\nVerification complete!")
 
-def show_all_students():
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute("""
+def parse_date(value, end_of_day=False):
+    """Epoch seconds for an ISO date or datetime. A bare `--until` date includes the whole day."""
+    parsed = datetime.fromisoformat(value)
+    if end_of_day and len(value) == 10:
+        parsed += timedelta(days=1)
+    return int(parsed.timestamp())
+
+def student_filters(status=None, since=None, until=None, domain=None):
+    """The WHERE clause and parameters for the `--all` filters, all applied in SQL"""
+    clauses, params = ["course = ?"], [COURSE]
+    if status == 'verified':
+        clauses.append("verified = TRUE")
+    elif status == 'pending':
+        clauses.append("verified = FALSE")
+    elif status is not None:
+        raise ValueError(f"Unknown status {status!r}, expected pending or verified")
+    if since:
+        clauses.append("submitted_ts >= ?")
+        params.append(parse_date(since))
+    if until:
+        clauses.append("submitted_ts < ?")
+        params.append(parse_date(until, end_of_day=True))
+    if domain:
+        escaped = domain.lower().lstrip('@').replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        clauses.append("email_normalized LIKE ? ESCAPE '\\'")
+        params.append(f"%@{escaped}")
+    return " AND ".join(clauses), params
+
+def iter_students(conn, where, params, page_size=LISTING_PAGE_SIZE):
+    """Streams matching students `page_size` rows at a time, so only one page is ever in memory"""
+    cursor = conn.execute(f"""
         SELECT user_id, username, email, submitted_at, verified
         FROM student_emails
-        ORDER BY submitted_at DESC
-    """)
-    
-    all_students = cursor.fetchall()
-    
-    if not all_students:
-        print("No students in database.")
-        conn.close()
+        WHERE {where}
+        ORDER BY submitted_ts DESC, user_id
+    """, params)
+    while True:
+        rows = cursor.fetchmany(page_size)
+        if not rows:
+            return
+        yield rows
+
+def print_student_table(pages, out):
+    """The original `--all` listing, pausing after each page when it's shown in a terminal"""
+    interactive = out is sys.stdout and sys.stdout.isatty() and sys.stdin.isatty()
+    shown = 0
+    for rows in pages:
+        if shown == 0:
+            print("\n" + "="*90, file=out)
+            print("ALL STUDENTS", file=out)
+            print("="*90, file=out)
+            print(f"{'User ID':<20} {'Username':<25} {'Email':<30} {'Submitted':<20} {'Status':<10}", file=out)
+            print("-"*90, file=out)
+        elif interactive:
+            if input(f"-- {shown} shown, Enter for more or q to stop -- ").strip().lower() == 'q':
+                break
+        for user_id, username, email, submitted_at, verified in rows:
+            submitted_date = datetime.fromisoformat(submitted_at).strftime("%Y-%m-%d %H:%M")
+            status = "Verified" if verified else "Pending"
+            print(f"{user_id:<20} {username:<25} {email:<30} {submitted_date:<20} {status:<10}", file=out)
+        shown += len(rows)
+    if shown:
+        print("\n" + "="*90, file=out)
+    return shown
+
+def write_student_csv(pages, out):
+    writer = csv.writer(out)
+    writer.writerow(['user_id', 'username', 'email', 'submitted_at', 'status'])
+    written = 0
+    for rows in pages:
+        writer.writerows(
+            (user_id, username, email, submitted_at, "verified" if verified else "pending")
+            for user_id, username, email, submitted_at, verified in rows
+        )
+        written += len(rows)
+    return written
+
+def write_student_jsonl(pages, out):
+    written = 0
+    for rows in pages:
+        for user_id, username, email, submitted_at, verified in rows:
+            # Discord IDs are too large for a JavaScript number, so keep them as strings
+            record = {
+                'user_id': str(user_id),
+                'username': username,
+                'email': email,
+                'submitted_at': submitted_at,
+                'status': "verified" if verified else "pending",
+            }
+            out.write(json.dumps(record) + "\n")
+        written += len(rows)
+    return written
+
+STUDENT_WRITERS = {
+    'table': print_student_table,
+    'csv': write_student_csv,
+    'jsonl': write_student_jsonl,
+}
+
+def show_all_students(status=None, since=None, until=None, domain=None, output_format='table', output_path=None,
+                      page_size=LISTING_PAGE_SIZE):
+    """Lists (or exports, with `output_format` csv/jsonl) the students matching the filters"""
+    if output_format not in STUDENT_WRITERS:
+        print(f"Unknown format {output_format!r}, expected one of: {', '.join(STUDENT_WRITERS)}")
+        return
+    try:
+        where, params = student_filters(status, since, until, domain)
+    except ValueError as e:
+        print(e)
         return
     
-    print("\n" + "="*90)
-    print("ALL STUDENTS")
-    print("="*90)
-    print(f"{'User ID':<20} {'Username':<25} {'Email':<30} {'Submitted':<20} {'Status':<10}")
-    print("-"*90)
-    
-    for user_id, username, email, submitted_at, verified in all_students:
-        submitted_date = datetime.fromisoformat(submitted_at).strftime("%Y-%m-%d %H:%M")
-        status = "Verified" if verified else "Pending"
-        print(f"{user_id:<20} {username:<25} {email:<30} {submitted_date:<20} {status:<10}")
+    # Keep anything else printed out of an export going to stdout
+    with contextlib.redirect_stdout(sys.stderr if output_format != 'table' else sys.stdout):
+        conn = connect_db()
+    try:
+        with open(output_path, 'w', newline='') if output_path else contextlib.nullcontext(sys.stdout) as out:
+            count = STUDENT_WRITERS[output_format](iter_students(conn, where, params, page_size), out)
+    finally:
+        conn.close()
     
-    print("\n" + "="*90)
-    conn.close()
+    if count == 0:
+        message = "No students match the filters." if len(params) > 1 else "No students in database."
+        print(message, file=sys.stderr if output_format != 'table' else sys.stdout)
+    elif output_path:
+        print(f"Wrote {count} students to {output_path}")
 
-async def auto_verify_from_csv():
+async def auto_verify_from_csv(authorized_emails=None):
     """Auto-verify all pending students whose emails are in Maven list"""
     if not os.path.exists(DATABASE_PATH):
         print(f"Database not found at {DATABASE_PATH}")
         return
     
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = connect_db()
     cursor = conn.cursor()
     
-    # Load authorized emails from CSV
-    authorized_emails = load_authorized_emails()
+    # Load authorized emails from CSV, unless `main` already downloaded them during startup
+    if authorized_emails is None:
+        authorized_emails = await asyncio.to_thread(load_authorized_emails, GATE.maven_url, GATE.snapshot_path)
+    
+    verified_users = mark_authorized_verified(conn, authorized_emails)
+    for user_id, username, email in verified_users:
+        print(f"✓ Auto-verified: {email}")
+    conn.commit()
     
     cursor.execute("""
-        SELECT user_id, username, email, submitted_at 
+        SELECT user_id, username, email 
         FROM student_emails 
-        WHERE verified = FALSE
-        ORDER BY submitted_at
-    """)
-    
-    pending_students = cursor.fetchall()
-    verified_users = []
-    unverified_users = []
-    
-    for user_id, username, email, submitted_at in pending_students:
-        if email.lower() in authorized_emails:
-            cursor.execute(
-                "UPDATE student_emails SET verified = TRUE WHERE user_id = ?",
-                (user_id,)
-            )
-            verified_users.append((user_id, username, email))
-            print(f"✓ Auto-verified: {email}")
-        else:
-            unverified_users.append((user_id, username, email))
-    
-    conn.commit()
+        WHERE course = ? AND verified = FALSE
+        ORDER BY submitted_ts
+    """, (COURSE,))
+    unverified_users = cursor.fetchall()
     conn.close()
     
-    if verified_users and client.is_ready():
+    if verified_users and discord_ready():
         print("\nAssigning Discord roles...")
-        for user_id, username, email in verified_users:
-            success = await assign_verified_role(user_id, username)
-            if success:
-                print(f"✓ Discord role assigned to: {username}")
-            else:
-                print(f"✗ Could not assign Discord role to: {username} (user_id: {user_id})")
+        result = await assign_verified_roles([(user_id, username) for user_id, username, _ in verified_users])
+        result.print_summary()
     
     # Display summary
     print(f"\nAuto-verification complete! Verified {len(verified_users)} students.")
@@ -323,7 +662,7 @@ async def auto_verify_from_csv():
     # If there are unverified users, display them and exit (non-interactive)
     if unverified_users:
         print("\n" + "="*80)
-        print("STUDENTS WHO COULD NOT BE AUTO-VERIFIED (NOT IN MAVEN LIST)")
+        print("STUDENTS WHO COULD NOT BE AUTO-VERIFIED (NOT IN MAVEN LIST OR EMAIL ALREADY CLAIMED)")
         print("="*80)
         print(f"{'Username':<25} {'Email':<40}")
         print("-"*80)
@@ -332,24 +671,26 @@ async def auto_verify_from_csv():
         print("="*80)
         print(f"\nTotal unverified: {len(unverified_users)} students")
 
-async def re_verify_all():
+async def re_verify_all(authorized_emails=None):
     """Re-assign verified role to ALL students in the database (both verified and unverified)"""
     if not os.path.exists(DATABASE_PATH):
         print(f"Database not found at {DATABASE_PATH}")
         return
     
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = connect_db()
     cursor = conn.cursor()
     
-    # Load authorized emails from CSV
-    authorized_emails = load_authorized_emails()
+    # Load authorized emails from CSV, unless `main` already downloaded them during startup
+    if authorized_emails is None:
+        authorized_emails = await asyncio.to_thread(load_authorized_emails, GATE.maven_url, GATE.snapshot_path)
     
     # Get ALL students from the database
-    cursor.execute("""
-        SELECT user_id, username, email, verified 
+    cursor.execute(f"""
+        SELECT user_id, username, email, email_normalized, verified, {CLAIMED_BY_ANOTHER_ACCOUNT_SQL}
         FROM student_emails 
+        WHERE course = ?
         ORDER BY username
-    """)
+    """, (COURSE,))
     
     all_students = cursor.fetchall()
     
@@ -359,8 +700,9 @@ async def re_verify_all():
     eligible_users = []
     ineligible_users = []
     
-    for user_id, username, email, verified in all_students:
-        if email.lower() in authorized_emails:
+    for user_id, username, email, normalized, verified, claimed in all_students:
+        # An email claimed first by another account is left for an administrator
+        if normalized in authorized_emails and (verified or not claimed):
             eligible_users.append((user_id, username, email, verified))
         else:
             ineligible_users.append((user_id, username, email, verified))
@@ -377,77 +719,405 @@ async def re_verify_all():
         print(f"  {username:<25} {email:<35}")
     
     # Update database to mark all eligible users as verified
-    for user_id, username, email, verified in eligible_users:
-        if not verified:
-            cursor.execute(
-                "UPDATE student_emails SET verified = TRUE WHERE user_id = ?",
-                (user_id,)
-            )
-            print(f"\n✓ Updated database for: {email}")
+    for user_id, username, email in mark_authorized_verified(conn, authorized_emails):
+        print(f"\n✓ Updated database for: {email}")
     
     conn.commit()
     conn.close()
     
     # Now assign Discord roles to ALL eligible users
-    if eligible_users and client.is_ready():
+    if eligible_users and discord_ready():
         print("\n\nAssigning Discord roles to ALL eligible users...")
         print("=" * 80)
         
-        success_count = 0
-        fail_count = 0
-        
-        for user_id, username, email, _ in eligible_users:
-            print(f"\nProcessing: {username} (ID: {user_id})")
-            success = await assign_verified_role(user_id, username)
-            if success:
-                print(f"  ✓ Discord role assigned successfully")
-                success_count += 1
-            else:
-                print(f"  ✗ Failed to assign role (user may not be in server)")
-                fail_count += 1
+        result = await assign_verified_roles([(user_id, username) for user_id, username, _, _ in eligible_users])
+        for user_id, username in result.assigned:
+            print(f"  ✓ Discord role assigned to: {username} (ID: {user_id})")
         
         print("\n" + "=" * 80)
-        print(f"SUMMARY: {success_count} successful, {fail_count} failed")
+        result.print_summary()
         print("=" * 80)
     else:
         print("\nDiscord client not ready or no eligible users found.")
     
     print(f"\nRe-verification complete!")
 
-async def run_verification():
+class ReconcilePlan:
+    """
+    What `--reconcile` would change, worked out in one pass over the course's rows against the roster and
+    the role holders. Each list is of (user_id, username, email).
+    """
+    def __init__(self):
+        self.add_roles = []
+        self.remove_roles = []
+        self.mark_verified = []
+        self.mark_unverified = []
+        # Role holders with no row for the course (e.g. staff), which are reported but never touched
+        self.unknown_role_holders = 0
+        self.unchanged = 0
+
+    def is_empty(self):
+        return not (self.add_roles or self.remove_roles or self.mark_verified or self.mark_unverified)
+
+    def print_diff(self):
+        for title, rows, sign in (
+            ("ROLE TO ADD (on the roster, without the role)", self.add_roles, '+'),
+            ("ROLE TO REMOVE (not on the roster, with the role)", self.remove_roles, '-'),
+            ("MARK VERIFIED IN DATABASE", self.mark_verified, '+'),
+            ("MARK UNVERIFIED IN DATABASE", self.mark_unverified, '-'),
+        ):
+            if not rows:
+                continue
+            print(f"\n{title} ({len(rows)}):")
+            print("-" * 80)
+            for user_id, username, email in rows:
+                print(f"  {sign} {username:<25} {email:<35} (ID: {user_id})")
+        print(
+            f"\nReconcile: +{len(self.add_roles)} roles, -{len(self.remove_roles)} roles, "
+            f"+{len(self.mark_verified)} verified, -{len(self.mark_unverified)} verified, "
+            f"{self.unchanged} unchanged, {self.unknown_role_holders} role holders not in the database (left alone)"
+        )
+
+def plan_reconcile(conn, authorized_emails, role_holders):
+    """
+    Diffs the three sets (role holders, students verified in the database and the roster) for `COURSE`. The
+    roster decides who should be verified, so students verified by hand who aren't on it are unverified too.
+    """
+    plan = ReconcilePlan()
+    students = set()
+    with SQLITE_QUERY_SECONDS.time(query='plan_reconcile'):
+        rows = conn.execute(f"""
+            SELECT user_id, username, email, email_normalized, verified, {CLAIMED_BY_ANOTHER_ACCOUNT_SQL}
+            FROM student_emails
+            WHERE course = ?
+            ORDER BY username
+        """, (COURSE,)).fetchall()
+    for user_id, username, email, normalized, verified, claimed in rows:
+        students.add(user_id)
+        eligible = normalized in authorized_emails and (bool(verified) or not claimed)
+        has_role = user_id in role_holders
+        row = (user_id, username, email)
+        if eligible == bool(verified) and eligible == has_role:
+            plan.unchanged += 1
+            continue
+        if eligible != bool(verified):
+            (plan.mark_verified if eligible else plan.mark_unverified).append(row)
+        if eligible != has_role:
+            (plan.add_roles if eligible else plan.remove_roles).append(row)
+    plan.unknown_role_holders = len(role_holders - students)
+    return plan
+
+def download_roster():
+    """
+    Downloads the course's roster for `--reconcile`. Unlike `load_authorized_emails` this raises if the download
+    fails instead of falling back to an older snapshot or an empty roster, since reconciling against either
+    would revoke students who are still enrolled.
+    """
+    roster = RosterSync(GATE.maven_url, snapshot_path=None)
+    roster.sync()
+    if not roster.emails:
+        raise ValueError(f"the roster at {GATE.maven_url} has no emails")
+    return roster.emails
+
+async def reconcile_roles(authorized_emails=None, apply=False, max_removals=RECONCILE_MAX_REMOVALS):
+    """
+    Brings the verified role and the database in line with the roster. Prints the diff, and only with `apply`
+    makes the changes: the database first, then only the role additions and removals in the diff. Refuses to
+    apply a diff that would revoke more than `max_removals` students.
+    """
     if not os.path.exists(DATABASE_PATH):
         print(f"Database not found at {DATABASE_PATH}")
-        print("Make sure the bot has run at least once to create the database.")
         return
-    
-    if len(sys.argv) > 1:
-        if sys.argv[1] == '--all':
-            show_all_students()
-        elif sys.argv[1] == '--auto':
-            await auto_verify_from_csv()
-        elif sys.argv[1] == '--reverify':
-            await re_verify_all()
-        elif sys.argv[1] == '--help':
-            print("Usage:")
-            print("  python verify_students.py          # Interactive verification")
-            print("  python verify_students.py --all    # Show all students")
-            print("  python verify_students.py --auto   # Auto-verify from Maven list")
-            print("  python verify_students.py --reverify # Re-assign role to ALL eligible students")
+    if not discord_ready():
+        print("Discord client not ready, can't tell who has the role.")
+        return
+
+    # Download the roster, unless `main` already did during startup
+    if authorized_emails is None:
+        try:
+            authorized_emails = await asyncio.to_thread(download_roster)
+        except Exception as e:
+            print(f"Could not load the {COURSE} roster, nothing was changed: {e}")
+            return
+
+    conn = connect_db()
+    role_holders = verified_role_holders()
+    plan = plan_reconcile(conn, authorized_emails, role_holders)
+    plan.print_diff()
+    if plan.is_empty():
+        print("\nNothing to reconcile.")
+        conn.close()
+        return
+    if not apply:
+        print("\nDry run, nothing was changed. Run again with --apply to make these changes.")
+        conn.close()
+        return
+    removals = {user_id for user_id, _, _ in plan.remove_roles + plan.mark_unverified}
+    if len(removals) > max_removals:
+        print(
+            f"\nRefusing to revoke {len(removals)} students (the limit is {max_removals}), nothing was changed. "
+            f"If the diff above is right, run again with --max-removals {len(removals)}."
+        )
+        conn.close()
+        return
+
+    mark_verified(conn, [user_id for user_id, _, _ in plan.mark_verified])
+    mark_unverified(conn, [user_id for user_id, _, _ in plan.mark_unverified])
+    conn.commit()
+    conn.close()
+    print(f"\n✓ Updated database for {len(plan.mark_verified) + len(plan.mark_unverified)} students")
+
+    for students, change in ((plan.add_roles, assign_verified_roles), (plan.remove_roles, revoke_verified_roles)):
+        if students:
+            result = await change([(user_id, username) for user_id, username, _ in students], role_holders)
+            result.print_summary()
+    print("\nReconcile complete!")
+
+class VerificationWatcher:
+    """
+    Incremental verification for `--watch`. Submissions are tracked with a `submitted_ts` watermark so each
+    tick only reads rows added since the previous one, and the roster is synced with conditional requests
+    so only emails newly added to it are matched against older pending rows. Neither moves on until the tick
+    has committed, so a tick that fails (e.g. while the bot holds the write lock) is retried on the next one.
+    """
+    def __init__(self, conn, roster):
+        self.conn = conn
+        self.roster = roster
+        self.watermark = 0
+        # Rows submitted in the same second as the watermark that have already been looked at
+        self.seen_at_watermark = set()
+        # Emails added to the roster that haven't been matched against older submissions yet
+        self.unmatched_added = set()
+        self.ticks = 0
+        self.last_tick = {}
+
+    def new_submissions(self):
+        """
+        The unverified rows submitted since the watermark, and the `(watermark, seen_at_watermark)` to move to
+        once they have been committed
+        """
+        with SQLITE_QUERY_SECONDS.time(query='new_submissions'):
+            rows = self.conn.execute(f"""
+                SELECT user_id, username, email, email_normalized, submitted_ts, {CLAIMED_BY_ANOTHER_ACCOUNT_SQL}
+                FROM student_emails
+                WHERE course = ? AND verified = FALSE AND submitted_ts >= ?
+                ORDER BY submitted_ts
+            """, (COURSE, self.watermark)).fetchall()
+        rows = [row for row in rows if row[0] not in self.seen_at_watermark]
+        watermark, seen_at_watermark = self.watermark, self.seen_at_watermark
+        if rows:
+            latest = rows[-1][4]
+            if latest > watermark:
+                watermark, seen_at_watermark = latest, set()
+            seen_at_watermark = seen_at_watermark | {row[0] for row in rows if row[4] == latest}
+        return rows, (watermark, seen_at_watermark)
+
+    async def tick(self):
+        start = time.perf_counter()
+        # `requests` is blocking, so keep it off the event loop and away from the gateway heartbeat
+        delta = await asyncio.to_thread(self.roster.sync)
+        # The roster has already moved on, so keep the additions until they are matched
+        self.unmatched_added |= delta.added
+        new_rows, watermark = self.new_submissions()
+        verified_users = [
+            (user_id, username, email)
+            for user_id, username, email, normalized, _, claimed in new_rows
+            if normalized in self.roster.emails and not claimed
+        ]
+        mark_verified(self.conn, [user_id for user_id, _, _ in verified_users])
+        if self.unmatched_added:
+            # Older submissions that only now appear on the roster
+            verified_users.extend(mark_authorized_verified(self.conn, self.unmatched_added))
+        self.conn.commit()
+        self.watermark, self.seen_at_watermark = watermark
+        self.unmatched_added = set()
+        for _, _, email in verified_users:
+            print(f"✓ Auto-verified: {email}")
+
+        result = RoleAssignmentResult()
+        if verified_users and discord_ready():
+            students = [(user_id, username) for user_id, username, _ in verified_users]
+            if REST_ONLY:
+                await fetch_members([user_id for user_id, _ in students])
+            result = await assign_verified_roles(students)
+            result.print_summary()
+
+        self.ticks += 1
+        self.last_tick = {
+            'tick': self.ticks,
+            'duration': time.perf_counter() - start,
+            'new_submissions': len(new_rows),
+            'roster_added': len(delta.added),
+            'roster_removed': len(delta.removed),
+            'verified': len(verified_users),
+            'roles_assigned': len(result.assigned),
+            'role_failures': len(result.not_in_guild) + len(result.failed),
+        }
+        print(
+            f"[watch] tick {self.ticks}: {len(new_rows)} new submissions, {len(delta.added)} added to roster, "
+            f"{len(verified_users)} verified, {len(result.assigned)} roles assigned "
+            f"in {self.last_tick['duration']:.2f}s"
+        )
+
+async def watch():
+    conn = connect_db()
+    watcher = VerificationWatcher(conn, RosterSync(GATE.maven_url, GATE.snapshot_path))
+    print(f"Watching for new submissions every {WATCH_INTERVAL:.0f}s (Ctrl+C to stop)")
+    try:
+        while True:
+            try:
+                await watcher.tick()
+            except Exception as e:
+                # Nothing from the failed tick was committed, so the next one looks at the same rows again
+                conn.rollback()
+                print(f"[watch] tick failed: {e}")
+            await asyncio.sleep(WATCH_INTERVAL)
+    finally:
+        conn.close()
+
+def members_needed(mode):
+    """The user IDs a mode may look up on Discord, so `--rest` only fetches those"""
+    if mode in ('--all', '--help', '--watch'):
+        # `--watch` fetches the members it needs on each tick
+        return []
+    conn = connect_db()
+    if mode == '--auto':
+        # Only students who are still unverified can be given the role
+        rows = conn.execute(
+            "SELECT user_id FROM student_emails WHERE course = ? AND verified = FALSE", (COURSE,)
+        ).fetchall()
     else:
-        result = display_pending_students()
+        rows = conn.execute("SELECT user_id FROM student_emails WHERE course = ?", (COURSE,)).fetchall()
+    conn.close()
+    return [user_id for user_id, in rows]
+
+def mode_from_argv():
+    """The mode (e.g. `--auto`), or None for interactive verification, ignoring flags and options with values"""
+    args = [arg for arg in sys.argv[1:] if arg not in FLAG_OPTIONS]
+    for option in VALUE_OPTIONS:
+        if option in args:
+            index = args.index(option)
+            del args[index:index + 2]
+    return args[0] if args else None
+
+async def run_verification(authorized_emails=None):
+    mode = mode_from_argv()
+    if mode == '--all':
+        show_all_students(
+            status=option_from_argv('--status'),
+            since=option_from_argv('--since'),
+            until=option_from_argv('--until'),
+            domain=option_from_argv('--domain'),
+            output_format=option_from_argv('--format', 'table'),
+            output_path=option_from_argv('--output'),
+            page_size=int(option_from_argv('--page-size', LISTING_PAGE_SIZE)),
+        )
+    elif mode == '--auto':
+        await auto_verify_from_csv(authorized_emails)
+    elif mode == '--reverify':
+        await re_verify_all(authorized_emails)
+    elif mode == '--reconcile':
+        await reconcile_roles(
+            authorized_emails,
+            apply='--apply' in sys.argv,
+            max_removals=int(option_from_argv('--max-removals', RECONCILE_MAX_REMOVALS)),
+        )
+    elif mode == '--watch':
+        await watch()
+    elif mode == '--help':
+        print("Usage:")
+        print("  python verify_students.py          # Interactive verification")
+        print("  python verify_students.py --all    # Show all students")
+        print("      [--status pending|verified] [--since DATE] [--until DATE] [--domain DOMAIN]")
+        print("      [--format table|csv|jsonl] [--output PATH] [--page-size N]")
+        print("  python verify_students.py --auto   # Auto-verify from Maven list")
+        print("  python verify_students.py --reverify # Re-assign role to ALL eligible students")
+        print("  python verify_students.py --reconcile # Show which roles to add and remove to match the roster")
+        print("      [--apply] [--max-removals N]    # ...and make those changes")
+        print("  python verify_students.py --watch  # Keep running, verifying new submissions as they come in")
+        print("  Add --rest to any of the above to fetch only the members needed over HTTP")
+        print("  Add --course NAME to any of the above to verify a course other than the default one")
+    elif mode is None:
+        result = display_pending_students(authorized_emails)
         if result:
             conn, verified_without_role, pending_students = result
             await verify_students(conn, verified_without_role, pending_students)
+    else:
+        print(f"Unknown option {mode}, see --help")
 
-async def main():
+# Modes that match the database against the roster
+ROSTER_MODES = (None, '--auto', '--reverify', '--reconcile')
+
+def prepare_database(mode):
+    """Runs any pending migration and, with `--rest`, reads which members the mode will need"""
+    connect_db().close()
+    return members_needed(mode) if REST_ONLY else []
+
+async def timed_step(step, awaitable):
+    with STARTUP_SECONDS.time(step=step):
+        return await awaitable
+
+async def connect_discord():
+    """Logs in and waits for the gateway to be ready (or, with `--rest`, for the guild lookup)"""
     await client.login(DISCORD_TOKEN)
-    asyncio.create_task(client.connect())
+    if REST_ONLY:
+        await connect_rest()
+        return
+    connect_task = asyncio.create_task(client.connect())
+    ready_task = asyncio.create_task(client.wait_until_ready())
+    done, _ = await asyncio.wait({connect_task, ready_task}, return_when=asyncio.FIRST_COMPLETED)
+    if connect_task in done:
+        # The connection ended before becoming ready, e.g. the members intent isn't enabled for the bot
+        ready_task.cancel()
+        connect_task.result()
+        raise RuntimeError("Discord connection closed before it was ready")
+
+async def main():
+    if not os.path.exists(DATABASE_PATH):
+        print(f"Database not found at {DATABASE_PATH}")
+        print("Make sure the bot has run at least once to create the database.")
+        return
     
-    while not client.is_ready():
-        await asyncio.sleep(1)
+    mode = mode_from_argv()
+    if mode in ('--all', '--help'):
+        # Listing and exporting only read the database, and shouldn't mix Discord's logging into the output
+        await run_verification()
+        return
     
-    await run_verification()
-    await client.close()
+    # Download the roster (in a thread, so a slow download can't starve the gateway heartbeat), prepare the
+    # database and connect to Discord all at once, so startup takes as long as the slowest of them
+    start = time.perf_counter()
+    roster_task = None
+    if mode == '--reconcile':
+        roster_task = asyncio.create_task(timed_step('roster', asyncio.to_thread(download_roster)))
+    elif mode in ROSTER_MODES:
+        roster_task = asyncio.create_task(timed_step(
+            'roster', asyncio.to_thread(load_authorized_emails, GATE.maven_url, GATE.snapshot_path)
+        ))
+    database_task = asyncio.create_task(timed_step('database', asyncio.to_thread(prepare_database, mode)))
+    try:
+        await timed_step('discord', connect_discord())
+        member_ids = await database_task
+        if REST_ONLY and discord_ready():
+            await timed_step('fetch_members', fetch_members(member_ids))
+        try:
+            authorized_emails = await roster_task if roster_task is not None else None
+        except Exception as e:
+            # Only `download_roster` raises, `load_authorized_emails` falls back to what it has
+            print(f"Could not load the {COURSE} roster, nothing was changed: {e}")
+            return
+        print(f"Started in {time.perf_counter() - start:.1f}s")
+        
+        await run_verification(authorized_emails)
+    finally:
+        for task in (roster_task, database_task):
+            if task is not None and not task.done():
+                task.cancel()
+        await client.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    try:
+        asyncio.run(main())
+    finally:
+        # Also on Ctrl+C, so `--watch` still reports what it did
+        metrics.write_summary(METRICS_PATH)